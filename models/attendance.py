@@ -0,0 +1,186 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+from models.ids import IdIndex
+
+# Response types that can be set on an attendance record.
+RESPONSE_TYPES = ['yes', 'no', 'maybe', 'invited', 'interested', 'not_interested']
+# Records buffered by AttendanceMatrices.add before they are folded into the CSR matrices.
+ATTENDANCE_MATRICES_COMPACT_EVERY = int(os.getenv("ATTENDANCE_MATRICES_COMPACT_EVERY", 10000))
+
+class AttendanceMatrices:
+    """
+    One sparse user x event matrix per response type, over dense user and event
+    indices. Entries count the attendance records carrying that response, so
+    column sums reproduce the per-event counts of the list-of-dict indexes.
+
+    add() keeps new records in a small per-type delta, indexed by user and by
+    event, which the queries merge with the CSR matrices; the delta is folded
+    into the matrices every ATTENDANCE_MATRICES_COMPACT_EVERY records, or when
+    csr() / csc() are asked for whole matrices. Ids registered since only pad
+    the shape. CSC copies are derived lazily for column (per-event) access.
+    """
+    def __init__(self, users=None, events=None):
+        self.users = users if users is not None else IdIndex()
+        self.events = events if events is not None else IdIndex()
+        self._csr = {}
+        self._csc = {}
+        self._pending = ([], [], [])
+        self._by_row = {kind: {} for kind in RESPONSE_TYPES}
+        self._by_col = {kind: {} for kind in RESPONSE_TYPES}
+
+    @property
+    def shape(self):
+        return (len(self.users), len(self.events))
+
+    def add(self, record):
+        # Buffers one attendance record ({'uid':..., 'eid':..., 'yes': True, ...}).
+        row = self.users.add(record['uid'])
+        col = self.events.add(record['eid'])
+        rows, cols, kinds = self._pending
+        for k, kind in enumerate(RESPONSE_TYPES):
+            if record.get(kind):
+                rows.append(row)
+                cols.append(col)
+                kinds.append(k)
+                self._by_row[kind].setdefault(row, []).append(col)
+                self._by_col[kind].setdefault(col, []).append(row)
+        if len(rows) >= ATTENDANCE_MATRICES_COMPACT_EVERY:
+            self.compact()
+
+    def compact(self):
+        # Folds the buffered records into the CSR matrices, padded to the current shape.
+        shape = self.shape
+        if not self._pending[0] and len(self._csr) == len(RESPONSE_TYPES) \
+                and all(m.shape == shape for m in self._csr.values()):
+            return
+        rows, cols, kinds = (np.array(a, dtype=np.int32) for a in self._pending)
+        for k, kind in enumerate(RESPONSE_TYPES):
+            old = self._base(kind)
+            old.resize(shape)
+            sel = kinds == k
+            if sel.any():
+                self._csr[kind] = old + sp.csr_matrix((np.ones(sel.sum(), dtype=np.int32), (rows[sel], cols[sel])),
+                                                      shape=shape)
+                self._csc.pop(kind, None)
+            elif kind in self._csc:
+                self._csc[kind].resize(shape)
+        self._pending = ([], [], [])
+        self._by_row = {kind: {} for kind in RESPONSE_TYPES}
+        self._by_col = {kind: {} for kind in RESPONSE_TYPES}
+
+    def add_columns(self, uids, eids, kinds):
+        # Vectorized add of many records: kinds maps response types to boolean
+        # arrays over the records. New ids are indexed in order of first appearance.
+        rows = self.users.add_many(uids)
+        cols = self.events.add_many(eids)
+        self.compact()
+        shape = self.shape
+        for kind in RESPONSE_TYPES:
+            sel = np.asarray(kinds[kind], dtype=bool) if kind in kinds else np.zeros(len(rows), dtype=bool)
+            m = sp.csr_matrix((np.ones(sel.sum(), dtype=np.int32), (rows[sel], cols[sel])), shape=shape)
+            self._csr[kind] = self._base(kind) + m
+        self._csc = {}
+
+    def _base(self, kind):
+        # The compacted matrix, without the delta; its shape may lag behind the ids.
+        if kind not in self._csr:
+            self._csr[kind] = sp.csr_matrix(self.shape, dtype=np.int32)
+        return self._csr[kind]
+
+    def _base_csc(self, kind):
+        if kind not in self._csc:
+            self._csc[kind] = self._base(kind).tocsc()
+        return self._csc[kind]
+
+    def csr(self, kind):
+        # The whole matrix, delta included.
+        self.compact()
+        return self._csr[kind]
+
+    def csc(self, kind):
+        self.compact()
+        return self._base_csc(kind)
+
+    def _row_entries(self, kind, rows):
+        # Row, column and count of every entry of the given user rows, delta included.
+        m = self._base(kind)
+        base = rows[rows < m.shape[0]]
+        sub = m[base]
+        entries = [np.repeat(base, np.diff(sub.indptr)), sub.indices, sub.data]
+        delta = self._by_row[kind]
+        added = [(row, col) for row in rows.tolist() for col in delta.get(row, ())] if delta else []
+        if added:
+            added = np.array(added, dtype=np.int64).reshape(-1, 2)
+            entries = [np.concatenate([entries[0], added[:, 0]]), np.concatenate([entries[1], added[:, 1]]),
+                       np.concatenate([entries[2], np.ones(len(added), dtype=sub.data.dtype)])]
+        return entries
+
+    def friend_counts(self, friend_uids, eids, kinds):
+        # Per-event record counts restricted to a set of users, walked from the users'
+        # side: one pass over the friends' CSR rows matched against the candidates,
+        # so the cost follows the friends' activity rather than event popularity.
+        rows = self.users.lookup(list(set(friend_uids)))
+        rows = rows[rows >= 0]
+        cols = self.events.lookup(eids)
+        out = np.zeros((len(cols), len(kinds)))
+        if not len(rows) or not len(cols):
+            return out
+        targets, inverse = np.unique(cols, return_inverse=True)
+        for k, kind in enumerate(kinds):
+            _, indices, data = self._row_entries(kind, rows)
+            pos = np.minimum(np.searchsorted(targets, indices), len(targets) - 1)
+            hit = targets[pos] == indices
+            out[:, k] = np.bincount(pos[hit], weights=data[hit], minlength=len(targets))[inverse]
+        return out
+
+    def top_events(self, uids, kinds):
+        # Events any of the users responded to with one of the kinds, ranked by how
+        # many of them did so.
+        rows = self.users.lookup(list(set(uids)))
+        rows = rows[rows >= 0]
+        if not len(rows):
+            return []
+        n = len(self.events)
+        pairs = []
+        for kind in kinds:
+            row, col, _ = self._row_entries(kind, rows)
+            pairs.append(row.astype(np.int64) * n + col)
+        cols, score = np.unique(np.unique(np.concatenate(pairs)) % n, return_counts=True)
+        return [self.events.external(c) for c in cols[np.argsort(-score, kind='stable')]]
+
+    def attendees(self, eid, kinds=('yes', 'maybe')):
+        # Sorted user rows with any of the given responses to an event.
+        col = self.events.get(eid)
+        parts = [np.zeros(0, dtype=np.int32)]
+        if col < 0:
+            return parts[0]
+        for kind in kinds:
+            m = self._base_csc(kind)
+            if col < m.shape[1]:
+                parts.append(m.indices[m.indptr[col]:m.indptr[col + 1]])
+            added = self._by_col[kind].get(col)
+            if added:
+                parts.append(np.array(added, dtype=np.int32))
+        return np.unique(np.concatenate(parts))
+
+def build_attendance_matrices(attendance_by_uid, user_ids=(), event_ids=(), ids=None):
+    """
+    Builds AttendanceMatrices from an attendance_by_uid index. The matrices index
+    users and events by the shared IdRegistry ids if given; otherwise user_ids and
+    event_ids seed private indices so they follow user_info / event_info order.
+    """
+    if ids is not None:
+        m = AttendanceMatrices(ids.users, ids.events)
+    else:
+        m = AttendanceMatrices(IdIndex(user_ids), IdIndex(event_ids))
+    arrays = getattr(attendance_by_uid, 'arrays', None)
+    if arrays is not None:
+        # A mapping over an AttendanceStore is read from its columns.
+        m.add_columns(*arrays())
+        return m
+    for records in attendance_by_uid.values():
+        for record in records:
+            m.add(record)
+    m.compact()
+    return m
@@ -0,0 +1,309 @@
+import os
+from bisect import bisect_left
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from collections.abc import Mapping
+from models.data_processing import ATTENDANCE_TYPES
+from models.ids import id_column
+
+# Records added since the sorted arrays were built are merged in once there are this many.
+ATTENDANCE_COMPACT_EVERY = int(os.getenv("ATTENDANCE_COMPACT_EVERY", 100000))
+# Bit of each response type in the flags bitfield.
+FLAG_BITS = {attr: 1 << k for k, attr in enumerate(ATTENDANCE_TYPES)}
+# The two orderings of the records: the side a group is keyed by and the side its records point to.
+SIDES = {'by_user': ('user', 'event'), 'by_event': ('event', 'user')}
+
+# Records of one user or one event: positions on the other side, flags and timestamps.
+AttendanceView = namedtuple('AttendanceView', ['positions', 'flags', 'timestamps'])
+# Everything a store holds: the sorted columns, plus the ids, records and per-key
+# groups added since they were built. compact() publishes a new one in one assignment.
+StoreState = namedtuple('StoreState', ['columns', 'new_ids', 'pending', 'pending_groups'])
+
+def empty_state(columns):
+    return StoreState(columns, {'user': {}, 'event': {}}, ([], [], [], []), {'by_user': {}, 'by_event': {}})
+
+def flag_mask(kinds):
+    mask = 0
+    for kind in kinds:
+        mask |= FLAG_BITS[kind]
+    return mask
+
+def record_flags(record):
+    return sum(bit for attr, bit in FLAG_BITS.items() if record.get(attr))
+
+def as_timestamp(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def id_order(ext):
+    # Sort key of an id: ints before strings, so ids of both types share one sorted array.
+    return (isinstance(ext, str), ext)
+
+def sorted_ids(ids):
+    """
+    The distinct ids in id_order and the position of every id among them. The
+    array is int64 when every id is an int and objects otherwise (id_column),
+    so no id is truncated or changes type.
+    """
+    ids = np.asarray(ids)
+    if ids.dtype.kind not in 'iu':
+        ids = id_column(ids.tolist())
+    if ids.dtype != object:
+        unique, inverse = np.unique(ids, return_inverse=True)
+        return unique, inverse.ravel()
+    values = ids.tolist()
+    unique = np.empty(len(set(values)), dtype=object)
+    unique[:] = sorted(set(values), key=id_order)
+    pos = {ext: i for i, ext in enumerate(unique.tolist())}
+    return unique, np.fromiter((pos[ext] for ext in values), dtype=np.int64, count=len(values))
+
+def group_columns(keys, others, flags, timestamps, count):
+    """
+    Sorts records by keys (dense positions below count), keeping their order
+    within a key, into offsets plus the other side, flags and timestamp columns.
+    """
+    order = np.argsort(keys, kind='stable')
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=count), out=offsets[1:])
+    return offsets, others[order].astype(np.int32), flags[order], timestamps[order]
+
+class AttendanceStore:
+    """
+    Attendance records as parallel arrays instead of one dict per record: int32
+    positions into sorted user and event id arrays, a uint8 flags bitfield over
+    ATTENDANCE_TYPES and a float64 timestamp, NaN when unknown. The records are
+    kept twice, grouped by user and by event with offset arrays, each group in
+    record order, so the records of one user or event are slices of the arrays.
+
+    columns holds every array under the names save_columns() writes, so a store
+    loaded from memory-mapped columns shares them between processes. add()
+    buffers new records, including ones for unseen ids; views include them, and
+    they are merged into the sorted arrays every ATTENDANCE_COMPACT_EVERY adds.
+    """
+    def __init__(self, columns):
+        self.state = empty_state(columns)
+
+    @property
+    def columns(self):
+        return self.state.columns
+
+    @classmethod
+    def from_columns(cls, uid, eid, flags, timestamps=None):
+        # Records given as parallel external-id, flags and timestamp arrays in record order.
+        uid, eid = np.asarray(uid), np.asarray(eid)
+        flags = np.asarray(flags, dtype=np.uint8)
+        timestamps = np.full(len(uid), np.nan) if timestamps is None else np.asarray(timestamps, dtype=np.float64)
+        user_ids, u = sorted_ids(uid)
+        event_ids, e = sorted_ids(eid)
+        columns = {'user_ids': user_ids, 'event_ids': event_ids}
+        for side, keys, others, count in (('by_user', u, e, len(user_ids)), ('by_event', e, u, len(event_ids))):
+            offsets, other, side_flags, side_timestamps = group_columns(keys, others, flags,
+                                                                        timestamps, count)
+            columns.update({side + '.offsets': offsets, side + '.' + SIDES[side][1]: other,
+                            side + '.flags': side_flags, side + '.timestamp': side_timestamps})
+        return cls(columns)
+
+    @classmethod
+    def from_records(cls, attendance_by_uid):
+        # An attendance_by_uid dict of record lists ({'uid':..., 'eid':..., 'yes': True, ...}).
+        records = [record for records in attendance_by_uid.values() for record in records]
+        return cls.from_columns(pd.Index([r['uid'] for r in records]).to_numpy(),
+                                pd.Index([r['eid'] for r in records]).to_numpy(),
+                                np.array([record_flags(r) for r in records], dtype=np.uint8),
+                                np.array([as_timestamp(r.get('timestamp')) for r in records], dtype=np.float64))
+
+    def __len__(self):
+        state = self.state
+        return len(state.columns['by_user.event']) + len(state.pending[0])
+
+    # --- Ids ---
+    def ids(self, kind):
+        return self.state.columns[kind + '_ids']
+
+    def position(self, kind, ext, state=None):
+        # Dense position of an external user or event id; -1 if it has no records.
+        state = self.state if state is None else state
+        ids = state.columns[kind + '_ids']
+        try:
+            pos = bisect_left(ids, id_order(ext), key=id_order) if ids.dtype == object \
+                else int(np.searchsorted(ids, ext))
+        except (TypeError, ValueError, OverflowError):
+            pos = len(ids)
+        if pos < len(ids) and ids[pos] == ext:
+            return pos
+        return state.new_ids[kind].get(ext, -1)
+
+    def external(self, kind, positions):
+        # External ids of many positions, as a list.
+        state = self.state
+        ids = state.columns[kind + '_ids']
+        positions = np.asarray(positions)
+        base = positions < len(ids)
+        if base.all():
+            return ids[positions].tolist()
+        extra = list(state.new_ids[kind])
+        known = iter(ids[positions[base]].tolist())
+        return [next(known) if ok else extra[p - len(ids)] for p, ok in zip(positions.tolist(), base.tolist())]
+
+    def keys(self, kind):
+        # External ids with records, sorted ones first, then ids added since.
+        state = self.state
+        yield from state.columns[kind + '_ids'].tolist()
+        yield from list(state.new_ids[kind])
+
+    def count(self, kind):
+        state = self.state
+        return len(state.columns[kind + '_ids']) + len(state.new_ids[kind])
+
+    # --- Views ---
+    def view(self, side, pos):
+        """
+        Records of the user (side 'by_user') or event ('by_event') at position
+        pos, in record order. Zero-copy slices unless records were added since
+        the last compaction.
+        """
+        key, other = SIDES[side]
+        state = self.state
+        columns = state.columns
+        offsets = columns[side + '.offsets']
+        if 0 <= pos < len(offsets) - 1:
+            lo, hi = offsets[pos], offsets[pos + 1]
+            view = AttendanceView(columns[side + '.' + other][lo:hi], columns[side + '.flags'][lo:hi],
+                                  columns[side + '.timestamp'][lo:hi])
+        else:
+            view = AttendanceView(np.zeros(0, np.int32), np.zeros(0, np.uint8), np.zeros(0, np.float64))
+        added = state.pending_groups[side].get(pos)
+        if added:
+            u, e, flags, timestamps = state.pending
+            others = u if other == 'user' else e
+            view = AttendanceView(np.concatenate([view.positions, np.array([others[i] for i in added], np.int32)]),
+                                  np.concatenate([view.flags, np.array([flags[i] for i in added], np.uint8)]),
+                                  np.concatenate([view.timestamps, np.array([timestamps[i] for i in added])]))
+        return view
+
+    def user(self, uid):
+        return self.view('by_user', self.position('user', uid))
+
+    def event(self, eid):
+        return self.view('by_event', self.position('event', eid))
+
+    def user_events(self, uid, kinds):
+        # Events uid responded to with any of the kinds, in record order.
+        view = self.user(uid)
+        return self.external('event', view.positions[(view.flags & flag_mask(kinds)) != 0])
+
+    def records(self, side, pos):
+        # The records of a view as attendance dicts, for call sites that still want them.
+        key, other = SIDES[side]
+        view = self.view(side, pos)
+        ext = self.external(key, [pos])[0]
+        records = []
+        for other_ext, flags, timestamp in zip(self.external(other, view.positions), view.flags.tolist(),
+                                               view.timestamps.tolist()):
+            record = {'uid': ext, 'eid': other_ext} if key == 'user' else {'uid': other_ext, 'eid': ext}
+            for attr, bit in FLAG_BITS.items():
+                if flags & bit:
+                    record[attr] = True
+            if timestamp == timestamp:
+                record['timestamp'] = timestamp
+            records.append(record)
+        return records
+
+    # --- Writes ---
+    def add(self, record):
+        # Buffers one attendance record ({'uid':..., 'eid':..., 'yes': True, ...}).
+        state = self.state
+        rows = []
+        for kind, ext in (('user', record['uid']), ('event', record['eid'])):
+            pos = self.position(kind, ext, state)
+            if pos < 0:
+                pos = state.new_ids[kind][ext] = len(state.columns[kind + '_ids']) + len(state.new_ids[kind])
+            rows.append(pos)
+        i = len(state.pending[0])
+        for column, value in zip(state.pending, rows + [record_flags(record), as_timestamp(record.get('timestamp'))]):
+            column.append(value)
+        state.pending_groups['by_user'].setdefault(rows[0], []).append(i)
+        state.pending_groups['by_event'].setdefault(rows[1], []).append(i)
+        if len(state.pending[0]) >= ATTENDANCE_COMPACT_EVERY:
+            self.compact()
+
+    def compact(self):
+        # Merges the buffered records into the sorted arrays; positions may change.
+        # The merged columns are built aside and swapped in with the empty buffers at once.
+        state = self.state
+        if not state.pending[0]:
+            return
+        u, e, flags, timestamps = (np.array(c, dtype=dtype) for c, dtype in
+                                   zip(state.pending, [np.int64, np.int64, np.uint8, np.float64]))
+        old, columns, remap = state.columns, dict(state.columns), {}
+        for kind in ('user', 'event'):
+            ids, new = old[kind + '_ids'], id_column(list(state.new_ids[kind]))
+            # New ids keep their own type: a longer string or a string among int ids is not cast.
+            ids = np.concatenate([ids, new]) if new.dtype == ids.dtype or not len(new) \
+                else np.array(ids.tolist() + new.tolist(), dtype=object)
+            columns[kind + '_ids'], remap[kind] = sorted_ids(ids)
+        for side, (key, other) in SIDES.items():
+            offsets = old[side + '.offsets']
+            keys = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+            keys = remap[key][np.concatenate([keys, u if key == 'user' else e]).astype(np.int64)]
+            others = np.concatenate([old[side + '.' + other], u if other == 'user' else e])
+            others = remap[other][others.astype(np.int64)]
+            grouped = group_columns(keys, others, np.concatenate([old[side + '.flags'], flags]),
+                                    np.concatenate([old[side + '.timestamp'], timestamps]),
+                                    len(columns[key + '_ids']))
+            for name, values in zip(['offsets', other, 'flags', 'timestamp'], grouped):
+                columns[side + '.' + name] = values
+        self.state = empty_state(columns)
+
+    # --- Bulk access ---
+    def arrays(self, side='by_user'):
+        """
+        (uids, eids, {response type: boolean array}) over every record, grouped
+        as side orders them, with external ids.
+        """
+        self.compact()
+        key, other = SIDES[side]
+        columns = self.columns
+        offsets = columns[side + '.offsets']
+        keys = np.repeat(columns[key + '_ids'], np.diff(offsets))
+        others = columns[other + '_ids'][columns[side + '.' + other]]
+        flags = np.asarray(columns[side + '.flags'])
+        kinds = {attr: (flags & bit) != 0 for attr, bit in FLAG_BITS.items()}
+        return (keys, others, kinds) if key == 'user' else (others, keys, kinds)
+
+    def by_user(self):
+        return AttendanceRecords(self, 'by_user')
+
+    def by_event(self):
+        return AttendanceRecords(self, 'by_event')
+
+class AttendanceRecords(Mapping):
+    """
+    attendance_by_uid / attendance_by_eid over an AttendanceStore: lists of
+    attendance dicts, built on each access. Writes go through store.add().
+    """
+    def __init__(self, store, side):
+        self.store = store
+        self.side = side
+        self.kind = SIDES[side][0]
+
+    def __getitem__(self, key):
+        pos = self.store.position(self.kind, key)
+        if pos < 0:
+            raise KeyError(key)
+        return self.store.records(self.side, pos)
+
+    def __contains__(self, key):
+        return self.store.position(self.kind, key) >= 0
+
+    def __iter__(self):
+        return self.store.keys(self.kind)
+
+    def __len__(self):
+        return self.store.count(self.kind)
+
+    def arrays(self):
+        return self.store.arrays(self.side)
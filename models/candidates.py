@@ -0,0 +1,41 @@
+class CandidateGenerator:
+    """
+    Cheap retrieval stage in front of full feature scoring.
+
+    Each source is a function (store, uid, limit) -> event ids in preference
+    order, registered under a name with a default limit. A source may return
+    more than limit ids so that ids rejected by accept can be replaced.
+    generate() runs the sources in registration order, keeps up to limit
+    accepted ids from each, unions them keeping the first occurrence of every
+    event, and reports how many candidates each source contributed.
+    """
+    def __init__(self):
+        self.sources = {}
+        self.limits = {}
+
+    def register(self, name, source, limit):
+        self.sources[name] = source
+        self.limits[name] = limit
+
+    def generate(self, store, uid, limits=None, accept=None):
+        limits = dict(self.limits, **(limits or {}))
+        seen = set()
+        candidates = []
+        counts = {}
+        for name, source in self.sources.items():
+            limit = int(limits.get(name, 0))
+            taken = 0
+            added = 0
+            if limit > 0:
+                for eid in source(store, uid, limit):
+                    if accept is not None and not accept(eid):
+                        continue
+                    taken += 1
+                    if eid not in seen:
+                        seen.add(eid)
+                        candidates.append(eid)
+                        added += 1
+                    if taken >= limit:
+                        break
+            counts[name] = added
+        return candidates, counts
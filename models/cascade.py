@@ -0,0 +1,94 @@
+import time
+import random
+import threading
+import numpy as np
+
+class CascadeRanker:
+    """
+    Ranks candidates in stages instead of running the whole Model on all of
+    them: first the LR share of Model.test for every candidate, computed from
+    only the feature columns the L1-sparse LR reads; then the top head
+    candidates by that pre-score get the remaining columns and the forest.
+    The head is ordered by the full score and the rest follow by pre-score;
+    the forest share is never negative, so the scores stay in ranked order.
+    A head of 0 scores every candidate in full.
+
+    features(eids, columns) returns (eids, X) like
+    process_events_for_user_batch, filling at least the given columns (all of
+    them for None). A random audit_rate share of the calls also scores every
+    candidate in full and counts how often the top k of the two rankings
+    differ, which is what head trades against latency.
+    """
+    def __init__(self, head, k, audit_rate):
+        self.head = head
+        self.k = k
+        self.audit_rate = audit_rate
+        # Kept apart from the global random state the feature engine draws from.
+        self.rng = random.Random()
+        self.requests = 0
+        self.audited = 0
+        self.topk_differs = 0
+        self.topk_overlap = 0.0
+        self.cascade_seconds = 0.0
+        self.full_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def rank(self, model, features, eids):
+        # Returns the kept eids best first, with their scores.
+        start = time.time()
+        if self.head > 0:
+            eids, scores = self.cascade(model, features, eids)
+        else:
+            eids, X = features(eids, None)
+            scores = model.test(X)
+        order = np.argsort(-scores, kind='stable')
+        ranked, scores = [eids[i] for i in order], scores[order]
+        elapsed = time.time() - start
+        if self.audit_rate and self.rng.random() < self.audit_rate:
+            self.audit(model, features, ranked)
+        with self.lock:
+            self.requests += 1
+            self.cascade_seconds += elapsed
+        return ranked, scores
+
+    def cascade(self, model, features, eids):
+        lr_columns = model.lr_features()
+        eids, X = features(eids, lr_columns)
+        scores = model.test_lr(X)
+        head = np.argsort(-scores, kind='stable')[:self.head]
+        if len(head) == 0:
+            return eids, scores
+        lr_set = set(lr_columns)
+        remaining = [col for col in range(X.shape[1]) if col not in lr_set]
+        _, X_head = features([eids[i] for i in head], remaining)
+        # The LR columns come from the first pass, so the head keeps its pre-score.
+        X_head[:, lr_columns] = X[head][:, lr_columns]
+        scores[head] += model.test_forest(X_head)
+        return eids, scores
+
+    def audit(self, model, features, ranked):
+        start = time.time()
+        eids, X = features(ranked, None)
+        full = np.argsort(-model.test(X), kind='stable')[:self.k]
+        elapsed = time.time() - start
+        expected = {eids[i] for i in full}
+        overlap = len(expected & set(ranked[:self.k])) / max(len(expected), 1)
+        with self.lock:
+            self.audited += 1
+            self.topk_differs += overlap < 1
+            self.topk_overlap += overlap
+            self.full_seconds += elapsed
+
+    def stats(self):
+        with self.lock:
+            return {
+                'head': self.head,
+                'k': self.k,
+                'requests': self.requests,
+                'audited': self.audited,
+                'topk_differs': self.topk_differs,
+                'topk_differ_rate': self.topk_differs / self.audited if self.audited else None,
+                'mean_topk_overlap': self.topk_overlap / self.audited if self.audited else None,
+                'mean_cascade_ms': 1000 * self.cascade_seconds / self.requests if self.requests else None,
+                'mean_full_ms': 1000 * self.full_seconds / self.audited if self.audited else None,
+            }
@@ -0,0 +1,243 @@
+import os
+import json
+import numpy as np
+from models.ids import IdIndex, id_column, grow
+from models.column_cache import save_columns, load_columns, column_values
+
+# Responses that put a user in an event's attendee set for co-attendance.
+COATTEND_TYPES = ('yes', 'maybe')
+
+def delta_path(filename):
+    # Live updates of the index saved at filename, kept apart from it (see CoAttendanceIndex.save_delta).
+    return filename + '.delta'
+
+class CoAttendanceIndex:
+    """
+    Top-K co-attendance neighbours of every event.
+
+    For each event row, neighbors holds up to k other event rows (-1 padded)
+    and overlaps the number of users in both yes/maybe attendee sets; sizes
+    holds each event's own attendee-set size. Pairs outside an event's top-K
+    are treated as having no overlap.
+
+    Live updates are not written over the saved index, whose manifest only
+    vouches for the attendance it was built from: save_delta appends them to a
+    separate file tagged with the digest of that index, and replay_delta applies
+    them again after the same index is loaded.
+    """
+    def __init__(self, events, neighbors, overlaps, sizes):
+        self.events = events
+        self.neighbors = neighbors
+        self.overlaps = overlaps
+        self.sizes = sizes
+        self.k = neighbors.shape[1]
+        self.updates = 0
+        # Digest of the cached artifact this index was loaded from, None if it was not.
+        self.digest = None
+        self.unsaved = []
+
+    def _row(self, eid):
+        row = self.events.add(eid)
+        self.neighbors = grow(self.neighbors, row + 1, -1)
+        self.overlaps = grow(self.overlaps, row + 1, 0)
+        self.sizes = grow(self.sizes, row + 1, 0)
+        return row
+
+    def _bump(self, a, b, overlap):
+        # overlap() is the pair's new overlap, only asked for when b is not yet a neighbour of a.
+        nb = self.neighbors[a]
+        slot = np.flatnonzero(nb == b)
+        if len(slot):
+            self.overlaps[a, slot[0]] += 1
+            return
+        free = np.flatnonzero(nb < 0)
+        if len(free):
+            self.neighbors[a, free[0]] = b
+            self.overlaps[a, free[0]] = 1
+            return
+        # A full list admits b in place of its weakest neighbour once b overlaps more.
+        low = np.argmin(self.overlaps[a])
+        count = overlap()
+        if count > self.overlaps[a, low]:
+            self.neighbors[a, low] = b
+            self.overlaps[a, low] = count
+
+    def add(self, eid, other_eids, overlap=None):
+        """
+        Records a user joining eid's attendee set, where other_eids are the events
+        that user already said yes/maybe to. Call it only when the user was not
+        already in eid's set.
+
+        A pair missing from a full neighbour list is only known to overlap by
+        one; overlap(eid, other), when given, returns the exact overlap of the two
+        attendee sets with the user included, so the pair can replace a weaker
+        neighbour. The overlaps it returned are saved with the update.
+        """
+        counts = self._add(eid, other_eids, overlap)
+        self.unsaved.append((eid, list(other_eids), counts))
+        self.updates += 1
+
+    def _add(self, eid, other_eids, overlap):
+        a = self._row(eid)
+        self.sizes[a] += 1
+        counts = {}
+        for other in set(other_eids):
+            if other == eid:
+                continue
+            b = self._row(other)
+            def count():
+                if other not in counts:
+                    counts[other] = overlap(eid, other) if overlap is not None else 1
+                return counts[other]
+            self._bump(a, b, count)
+            self._bump(b, a, count)
+        return counts
+
+    def user_similarity(self, eids, past_eids):
+        """
+        The co-attendance similarity feature: for each candidate, the average
+        overlap / min(set sizes) against the user's past yes/maybe events, where the
+        user's own attendance is excluded from the overlap. past_eids may repeat an
+        event (one entry per attendance record); repeats are weighted like the
+        record loop does. NaN when there is no past event other than the candidate.
+        """
+        past = {}
+        for eid in past_eids:
+            past[eid] = past.get(eid, 0) + 1
+        prow = self.events.lookup(list(past))
+        mult = np.fromiter(past.values(), dtype=np.int64, count=len(past))
+        ok = (prow >= 0) & (prow < len(self.sizes))
+        order = np.argsort(prow[ok])
+        prow, mult = prow[ok][order], mult[ok][order]
+        rows = self.events.lookup(list(eids))
+        known = (rows >= 0) & (rows < len(self.sizes))
+        in_past = np.fromiter((past.get(eid, 0) for eid in eids), dtype=np.int64, count=len(eids))
+        total = np.zeros(len(eids))
+        if known.any() and len(prow):
+            r = rows[known]
+            nb = self.neighbors[r]
+            pos = np.minimum(np.searchsorted(prow, nb), len(prow) - 1)
+            weight = np.where(prow[pos] == nb, mult[pos], 0)
+            denom = np.minimum(self.sizes[r][:, None], self.sizes[np.where(nb >= 0, nb, 0)])
+            num = self.overlaps[r] - (in_past[known] > 0)[:, None]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sims = np.where((weight > 0) & (denom > 0), num / denom, 0.0)
+            total[known] = (sims * weight).sum(axis=1)
+        count = sum(past.values()) - in_past
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    def neighbors_of(self, eids):
+        # Neighbours of a set of events, ranked by their summed overlap with the set.
+        rows = self.events.lookup(list(set(eids)))
+        rows = rows[(rows >= 0) & (rows < len(self.sizes))]
+        nb = self.neighbors[rows].ravel()
+        ov = self.overlaps[rows].ravel()
+        keep = nb >= 0
+        if not keep.any():
+            return []
+        cols, inverse = np.unique(nb[keep], return_inverse=True)
+        score = np.bincount(inverse, weights=ov[keep])
+        return [self.events.external(c) for c in cols[np.argsort(-score, kind='stable')]]
+
+    def save(self, dirname):
+        # Written with save_columns; ids keep their types (id_column), so events of any id type remap on load.
+        # A shared event index may hold events this index has no row for yet.
+        n = min(len(self.events), len(self.sizes))
+        save_columns(dirname, {'ids': id_column(self.events.ids[:n]), 'neighbors': self.neighbors[:n],
+                               'overlaps': self.overlaps[:n], 'sizes': self.sizes[:n]})
+        print(f"[CACHE] Co-attendance index saved to {dirname}")
+
+    def save_delta(self, filename):
+        """
+        Appends the updates made since the last call to the delta file, one JSON
+        line per add(). A new file starts with the digest of the index it applies to.
+        """
+        if not self.unsaved or self.digest is None:
+            return
+        path = delta_path(filename)
+        with open(path, 'a') as f:
+            if f.tell() == 0:
+                f.write(json.dumps({'digest': self.digest}) + '\n')
+            for eid, other_eids, counts in self.unsaved:
+                f.write(json.dumps([eid, other_eids, list(counts.items())], default=lambda v: v.item()) + '\n')
+        self.unsaved = []
+        print(f"[CACHE] Co-attendance updates saved to {path}")
+
+    def replay_delta(self, filename):
+        # Applies the saved updates of this index; a delta written for another build of it is removed.
+        path = delta_path(filename)
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            header = json.loads(f.readline() or 'null')
+            if not header or header.get('digest') != self.digest:
+                print(f"[CACHE] Dropping {path}, written for another co-attendance index")
+                f.close()
+                os.remove(path)
+                return
+            count = 0
+            for line in f:
+                eid, other_eids, counts = json.loads(line)
+                counts = dict(counts)
+                self._add(eid, other_eids, lambda eid, other: counts.get(other, 1))
+                count += 1
+        print(f"[CACHE] Replayed {count} co-attendance updates from {path}")
+
+    @classmethod
+    def load(cls, dirname, events=None):
+        """
+        Loads a saved index. Given an event IdIndex (e.g. the store's shared one),
+        the saved rows are moved to that index's positions, adding unknown events.
+        The arrays are copied out of the mapped files, since live updates write to them.
+        """
+        if not os.path.exists(os.path.join(dirname, 'meta.json')):
+            return None
+        columns, _ = load_columns(dirname)
+        ids = column_values(columns['ids'])
+        neighbors, overlaps, sizes = (np.array(columns[name]) for name in ['neighbors', 'overlaps', 'sizes'])
+        if events is None:
+            events = IdIndex(ids)
+        elif events.ids[:len(ids)] != ids:
+            rows = np.array([events.add(ext) for ext in ids], dtype=np.int32)
+            n = max(len(events), len(ids))
+            moved = np.full((n, neighbors.shape[1]), -1, dtype=np.int32)
+            moved[rows] = np.where(neighbors >= 0, rows[neighbors], -1)
+            neighbors = moved
+            moved = np.zeros((n, overlaps.shape[1]), dtype=np.int32)
+            moved[rows] = overlaps
+            overlaps = moved
+            moved = np.zeros(n, dtype=np.int32)
+            moved[rows] = sizes
+            sizes = moved
+        index = cls(events, neighbors, overlaps, sizes)
+        print(f"[CACHE] Loaded co-attendance index from {dirname}")
+        return index
+
+def build_coattendance_index(matrices, k=50, chunk=4096):
+    """
+    Builds the index offline from AttendanceMatrices: the event x event overlap
+    matrix B.T @ B of the binary yes/maybe matrix B, computed in row chunks and
+    cut to the k largest overlaps per event.
+    """
+    B = matrices.csr(COATTEND_TYPES[0]) + matrices.csr(COATTEND_TYPES[1])
+    B.data[:] = 1
+    B = B.tocsc()
+    n = B.shape[1]
+    neighbors = np.full((n, k), -1, dtype=np.int32)
+    overlaps = np.zeros((n, k), dtype=np.int32)
+    sizes = B.getnnz(axis=0).astype(np.int32)
+    for start in range(0, n, chunk):
+        stop = min(start + chunk, n)
+        C = (B[:, start:stop].T @ B).tocsr()
+        for i in range(stop - start):
+            cols = C.indices[C.indptr[i]:C.indptr[i + 1]]
+            vals = C.data[C.indptr[i]:C.indptr[i + 1]]
+            keep = cols != start + i
+            cols, vals = cols[keep], vals[keep]
+            if len(cols) > k:
+                top = np.argpartition(-vals, k - 1)[:k]
+                cols, vals = cols[top], vals[top]
+            neighbors[start + i, :len(cols)] = cols
+            overlaps[start + i, :len(cols)] = vals
+    return CoAttendanceIndex(matrices.events, neighbors, overlaps, sizes)
@@ -0,0 +1,351 @@
+import os
+import json
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from models.data_processing import ATTENDANCE_TYPES, event_word_columns
+from models.attendance_store import AttendanceStore
+from models.ids import IdIndex, IdRegistry, id_column
+
+# Values a ColumnMapping keeps after building them for a read; older ones are rebuilt when read again.
+COLUMN_MAPPING_CACHE = int(os.getenv("COLUMN_MAPPING_CACHE", 100000))
+
+# --- Column files ---
+
+class EncodedColumn:
+    """
+    Dictionary-encoded object column: int32 codes into a vocabulary, -1 for
+    missing values (read back as NaN, as pandas produced them).
+    """
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, row):
+        code = int(self.codes[row])
+        if code < 0:
+            return np.nan
+        value = self.values[code]
+        return value.item() if isinstance(value, np.generic) else value
+
+def save_columns(dirname, columns, meta=None):
+    """
+    Writes each column to dirname/<name>.npy. Object columns are stored as int32
+    codes plus a vocabulary, which is a plain NumPy array when every value is a
+    string or number and a pickle otherwise. The directory is written aside and
+    swapped in at the end, so readers never see a partial cache.
+    """
+    tmp = dirname + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    encoded = {}
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if values.dtype != object:
+            np.save(os.path.join(tmp, name + '.npy'), values)
+            continue
+        codes, uniques = pd.factorize(values)
+        np.save(os.path.join(tmp, name + '.codes.npy'), codes.astype(np.int32))
+        uniques = list(uniques)
+        vocabulary = np.asarray(uniques)
+        if vocabulary.dtype != object and vocabulary.tolist() != uniques:
+            # NumPy would store mixed values as one type (ints as strings); keep each as it is.
+            vocabulary = np.empty(len(uniques), dtype=object)
+            vocabulary[:] = uniques
+        pickled = vocabulary.dtype == object
+        np.save(os.path.join(tmp, name + '.values.npy'), vocabulary, allow_pickle=pickled)
+        encoded[name] = pickled
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(dict(meta or {}, columns=list(columns), encoded=encoded), f)
+    shutil.rmtree(dirname, ignore_errors=True)
+    os.rename(tmp, dirname)
+
+def load_columns(dirname):
+    # Memory-maps every column, so processes loading the same cache share its pages.
+    with open(os.path.join(dirname, 'meta.json')) as f:
+        meta = json.load(f)
+    columns = {}
+    for name in meta['columns']:
+        if name in meta['encoded']:
+            pickled = meta['encoded'][name]
+            values = np.load(os.path.join(dirname, name + '.values.npy'),
+                             mmap_mode=None if pickled else 'r', allow_pickle=pickled)
+            columns[name] = EncodedColumn(np.load(os.path.join(dirname, name + '.codes.npy'), mmap_mode='r'), values)
+        else:
+            columns[name] = np.load(os.path.join(dirname, name + '.npy'), mmap_mode='r')
+    return columns, meta
+
+def cell(column, row):
+    # One value of a column as a Python scalar.
+    if isinstance(column, EncodedColumn):
+        return column[row]
+    return column[row].item()
+
+# --- Key indexes ---
+
+def record_index(keys):
+    # dict semantics over a key column: iteration follows first appearance, the last row wins.
+    keys = np.asarray(keys)
+    last = len(keys) - 1 - np.unique(keys[::-1], return_index=True)[1]
+    first = np.sort(np.unique(keys, return_index=True)[1])
+    return {'index.keys': keys[last], 'index.handles': last, 'index.iter': keys[first]}
+
+class ColumnMapping(MutableMapping):
+    """
+    dict view over values stored in memory-mapped columns. Keys are found by
+    binary search over a sorted key column; a value is built by build(handle) on
+    access and the last maxsize built values are kept in an LRU, so a
+    long-running process holds a bounded number of them. Nothing is built for
+    keys that are never read. Assigned values are kept for good: to change a
+    value, assign it back (mapping[key] = value) rather than only editing the
+    object returned by a read, which may be rebuilt from the columns later.
+    """
+    def __init__(self, keys, handles, iter_keys, build, maxsize=COLUMN_MAPPING_CACHE):
+        self.sorted_keys = keys
+        self.handles = handles
+        self.iter_keys = iter_keys
+        self.build = build
+        self.maxsize = maxsize
+        self.items_built = OrderedDict()
+        self.assigned = {}
+        self.added = {}
+        self.deleted = set()
+        self.lock = threading.Lock()
+
+    def handle(self, key):
+        try:
+            pos = int(np.searchsorted(self.sorted_keys, key))
+        except (TypeError, ValueError, OverflowError):
+            return -1
+        if pos < len(self.sorted_keys) and self.sorted_keys[pos] == key:
+            return int(self.handles[pos]) if self.handles is not None else pos
+        return -1
+
+    def __getitem__(self, key):
+        if key in self.assigned:
+            return self.assigned[key]
+        with self.lock:
+            if key in self.items_built:
+                self.items_built.move_to_end(key)
+                return self.items_built[key]
+        h = -1 if key in self.deleted else self.handle(key)
+        if h < 0:
+            raise KeyError(key)
+        value = self.build(h)
+        with self.lock:
+            self.items_built[key] = value
+            while len(self.items_built) > self.maxsize:
+                self.items_built.popitem(last=False)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.deleted:
+            self.deleted.discard(key)
+        elif key not in self.assigned and self.handle(key) < 0:
+            self.added[key] = None
+        self.assigned[key] = value
+        with self.lock:
+            self.items_built.pop(key, None)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.assigned.pop(key, None)
+        with self.lock:
+            self.items_built.pop(key, None)
+        if key in self.added:
+            del self.added[key]
+        else:
+            self.deleted.add(key)
+
+    def __contains__(self, key):
+        return key in self.assigned or (key not in self.deleted and self.handle(key) >= 0)
+
+    def __iter__(self):
+        for start in range(0, len(self.iter_keys), 65536):
+            for key in self.iter_keys[start:start + 65536].tolist():
+                if key not in self.deleted:
+                    yield key
+        yield from list(self.added)
+
+    def __len__(self):
+        return len(self.iter_keys) - len(self.deleted) + len(self.added)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} with {len(self)} keys>"
+
+class RecordMapping(ColumnMapping):
+    """
+    Keyed records (user_info, event_info) over one row per key. fields lists
+    (name, kind, arg) in record order: 'value' reads column arg, 'point' builds
+    [lat, lng] from the two columns in arg (None if either is NaN), 'int' reads
+    a float column as an int or None, 'vector' reads a matrix row as a list and
+    'item' one entry of it.
+    """
+    def __init__(self, columns, fields):
+        self.columns = columns
+        self.fields = fields
+        ColumnMapping.__init__(self, columns['index.keys'], columns['index.handles'], columns['index.iter'],
+                               self.record)
+
+    def field(self, row, kind, arg):
+        if kind == 'value':
+            return cell(self.columns[arg], row)
+        if kind == 'point':
+            lat, lng = self.columns[arg[0]][row], self.columns[arg[1]][row]
+            return None if np.isnan(lat) or np.isnan(lng) else [lat.item(), lng.item()]
+        if kind == 'int':
+            v = self.columns[arg][row]
+            return None if np.isnan(v) else int(v)
+        if kind == 'vector':
+            return self.columns[arg][row].tolist()
+        return self.columns[arg[0]][row, arg[1]].item()
+
+    def record(self, row):
+        return {name: self.field(row, kind, arg) for name, kind, arg in self.fields}
+
+    def field_values(self, name):
+        # One field for every key, in iteration order, without building whole records.
+        # Vectors come back as rows of the memory-mapped matrix.
+        kind, arg = next((kind, arg) for n, kind, arg in self.fields if n == name)
+        values = []
+        for key in self:
+            if key in self.assigned:
+                values.append(self.assigned[key].get(name))
+            elif kind == 'vector':
+                values.append(self.columns[arg][self.handle(key)])
+            else:
+                values.append(self.field(self.handle(key), kind, arg))
+        return values
+
+    def point_values(self, name):
+        # A 'point' field for every key as an (n, 2) array in iteration order, NaN
+        # where missing; read from the columns, with records assigned since overlaid.
+        if self.added or self.deleted:
+            return np.array([p or (np.nan, np.nan) for p in self.field_values(name)], dtype=np.float64).reshape(-1, 2)
+        arg = next(arg for n, kind, arg in self.fields if n == name and kind == 'point')
+        lat, lng = np.asarray(self.columns[arg[0]]), np.asarray(self.columns[arg[1]])
+        if len(self.iter_keys) == len(lat):
+            # Every key has one row, so iteration follows the rows.
+            position = self.handles
+            points = np.column_stack([lat, lng])
+        else:
+            sorted_pos = np.searchsorted(self.sorted_keys, self.iter_keys)
+            points = np.column_stack([lat[self.handles[sorted_pos]], lng[self.handles[sorted_pos]]])
+            position = np.empty(len(sorted_pos), dtype=np.int64)
+            position[sorted_pos] = np.arange(len(sorted_pos))
+        for key, record in self.assigned.items():
+            points[position[np.searchsorted(self.sorted_keys, key)]] = record.get(name) or (np.nan, np.nan)
+        return points
+
+    def key_array(self):
+        # Keys in iteration order as an array.
+        if self.added or self.deleted:
+            return np.array(list(self))
+        return np.asarray(self.iter_keys)
+
+def field_values(mapping, name):
+    # A field of every record of a dict-of-dicts, read from the columns when possible.
+    if isinstance(mapping, RecordMapping):
+        return mapping.field_values(name)
+    return [record.get(name) for record in mapping.values()]
+
+# --- user_info ---
+
+def save_user_info(dirname, users):
+    """
+    users is either process_users(as_columns=True) or a user_info dict, which
+    may carry the inferred 'location' and 'age' fields.
+    """
+    if isinstance(users, dict) and 'id' in users and isinstance(users['id'], np.ndarray):
+        columns = {'id': users['id'], 'birth': users['birth'], 'gender': users['gender']}
+        has_age = False
+    else:
+        records = list(users.values())
+        columns = {'id': np.array([u['id'] for u in records], dtype=np.int64),
+                   'birth': pd.Series([u['birth'] for u in records]).to_numpy(),
+                   'gender': np.array([u['gender'] for u in records], dtype=object)}
+        points = [u.get('location') or (np.nan, np.nan) for u in records]
+        columns['location.lat'] = np.array([p[0] for p in points], dtype=np.float64)
+        columns['location.lng'] = np.array([p[1] for p in points], dtype=np.float64)
+        has_age = any('age' in u for u in records)
+        if has_age:
+            columns['age'] = np.array([np.nan if u.get('age') is None else u['age'] for u in records], dtype=np.float64)
+    if 'location.lat' not in columns:
+        columns['location.lat'] = np.full(len(columns['id']), np.nan)
+        columns['location.lng'] = np.full(len(columns['id']), np.nan)
+    fields = [('id', 'value', 'id'), ('birth', 'value', 'birth'), ('gender', 'value', 'gender'),
+              ('location', 'point', ['location.lat', 'location.lng'])]
+    if has_age:
+        fields.append(('age', 'int', 'age'))
+    columns.update(record_index(columns['id']))
+    save_columns(dirname, columns, {'fields': fields})
+
+def load_user_info(dirname):
+    columns, meta = load_columns(dirname)
+    return RecordMapping(columns, [tuple(f) for f in meta['fields']])
+
+# --- event_info ---
+
+def save_event_info(dirname, events):
+    # events is process_events(as_columns=True): every CSV column plus 'words'.
+    header = list(events['fields'])
+    words = event_word_columns(header)
+    columns = {name: events[name] for name in header if name not in words}
+    columns['words'] = np.ascontiguousarray(events['words'])
+    fields = [(name, 'item', ['words', words.index(name)]) if name in words else (name, 'value', name)
+              for name in header]
+    fields += [('location', 'point', ['lat', 'lng']), ('words', 'vector', 'words'), ('id', 'value', 'event_id')]
+    columns.update(record_index(columns['event_id']))
+    save_columns(dirname, columns, {'fields': fields})
+
+def load_event_info(dirname):
+    columns, meta = load_columns(dirname)
+    return RecordMapping(columns, [tuple(f) for f in meta['fields']])
+
+# --- friends ---
+
+def save_friends(dirname, friends):
+    # friends is process_friends(as_columns=True): uid, friends and offsets.
+    columns = dict(friends)
+    columns.update(record_index(friends['uid']))
+    save_columns(dirname, columns)
+
+def load_friends(dirname):
+    columns, _ = load_columns(dirname)
+    flat, offsets = columns['friends'], columns['offsets']
+    return ColumnMapping(columns['index.keys'], columns['index.handles'], columns['index.iter'],
+                         lambda row: flat[offsets[row]:offsets[row + 1]].tolist())
+
+# --- attendance ---
+
+def save_attendance(dirname, attendance):
+    # attendance is process_attendance(as_columns=True): uid, eid and flags.
+    store = AttendanceStore.from_columns(attendance['uid'], attendance['eid'], attendance['flags'])
+    save_columns(dirname, store.columns, {'flag_types': ATTENDANCE_TYPES})
+
+def load_attendance(dirname):
+    columns, _ = load_columns(dirname)
+    return AttendanceStore(columns)
+
+# --- ids ---
+
+def save_ids(dirname, registry):
+    # registry is an IdRegistry; each id space is stored in position order.
+    save_columns(dirname, {'users': id_column(registry.users.ids), 'events': id_column(registry.events.ids)})
+
+def load_ids(dirname):
+    columns, _ = load_columns(dirname)
+    return IdRegistry(*(IdIndex(column_values(columns[name])) for name in ['users', 'events']))
+
+def column_values(column):
+    # Every value of a column as Python scalars.
+    if isinstance(column, EncodedColumn):
+        return [column[row] for row in range(len(column))]
+    return column.tolist()
@@ -1,123 +1,348 @@
+import os
+import time
+import calendar
 import pandas as pd
 import numpy as np
 from math import isnan
 from dateutil.parser import parse
 from collections import defaultdict
 
-def process_users():
-    users_df = pd.read_csv("models/data/users.csv")
+# Source files of the data caches.
+USERS_CSV = "models/data/users.csv"
+EVENTS_CSV = "models/data/events_sampled_25.csv"
+FRIENDS_CSV = "models/data/user_friends.csv"
+EVENT_ATTENDEES_CSV = "models/data/event_attendees.csv"
+TRAIN_CSV = "models/data/train.csv"
+
+# Response types read from event_attendees.csv and train.csv, in the order they are applied.
+ATTENDEE_TYPES = ['yes', 'maybe', 'invited', 'no']
+TRAIN_TYPES = ['invited', 'interested', 'not_interested']
+# Bit k of an attendance flags value is set when the pair has response ATTENDANCE_TYPES[k].
+ATTENDANCE_TYPES = ATTENDEE_TYPES + [t for t in TRAIN_TYPES if t not in ATTENDEE_TYPES]
+# Working-memory ceiling for streaming attendance ingestion; 0 reads each file in one go.
+ATTENDANCE_MEMORY_MB = int(os.getenv("ATTENDANCE_MEMORY_MB", 512)) or None
+# Rough transient cost of one exploded (uid, eid) pair while parsing, strings included.
+PAIR_BYTES = 96
+# Upper bound on label propagation rounds in fill_missing_location; it stops earlier on convergence.
+LOCATION_ROUNDS = int(os.getenv("LOCATION_ROUNDS", 10))
+
+def epoch_seconds(value):
+    # dateutil fallback for one date string; times without an offset are UTC.
+    return calendar.timegm(parse(str(value)).utctimetuple())
+
+def parse_timestamps(values):
+    """
+    Parses a column of date strings once into int64 epoch seconds, fractions
+    dropped. The ISO 8601 timestamps of the Kaggle files are read in one
+    vectorized pass; only rows it cannot read go through dateutil. Times
+    without an offset are taken as UTC.
+    """
+    values = pd.Series(values, dtype=object)
+    parsed = pd.to_datetime(values, format='ISO8601', utc=True, errors='coerce')
+    known = parsed.notna().to_numpy()
+    seconds = np.zeros(len(values), dtype=np.int64)
+    seconds[known] = ((parsed[known] - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
+    for i in np.flatnonzero(~known).tolist():
+        seconds[i] = epoch_seconds(values.iloc[i])
+    return seconds
+
+def split_id_lists(values):
+    """
+    Splits a column of space-separated id lists in one pass. Returns the flat
+    int64 ids and the number of ids in each row; missing cells count zero.
+    """
+    values = pd.Series(values, dtype=object)
+    present = values.notna().to_numpy()
+    strings = values[present].astype(str)
+    lengths = np.zeros(len(values), dtype=np.int64)
+    lengths[present] = strings.str.split().str.len().to_numpy()
+    flat = np.array(' '.join(strings).split(), dtype=np.int64)
+    return flat, lengths
+
+def process_users(as_columns=False):
+    # birthyear keeps pandas' inferred type; process_and_update_ages parses it.
+    users_df = pd.read_csv(USERS_CSV, usecols=['user_id', 'birthyear', 'gender'],
+                           dtype={'user_id': np.int64, 'gender': object})
+    columns = {
+        'id': users_df['user_id'].to_numpy(),
+        'birth': users_df['birthyear'].to_numpy(),
+        'gender': users_df['gender'].to_numpy(),
+    }
+    if as_columns:
+        return columns
     user_info = {}
-    for _, row in users_df.iterrows():
-        uid = int(row['user_id'])
+    for uid, birth, gender in zip(columns['id'].tolist(), columns['birth'].tolist(), columns['gender'].tolist()):
         user_info[uid] = {
             'id': uid,
-            'birth': row['birthyear'],
-            'gender': row['gender'],
+            'birth': birth,
+            'gender': gender,
             'location': None  # will be filled later via inference
             # add any additional fields if needed
         }
     return user_info
 
-def process_events():
-    events_df = pd.read_csv("models/data/events_sampled_25.csv")
+def event_word_columns(header):
+    # Feature words are columns 9 to 110 (if available)
+    return list(header[9:110]) if len(header) >= 110 else []
+
+def process_events(as_columns=False):
+    path = EVENTS_CSV
+    header = pd.read_csv(path, nrows=0).columns
+    word_columns = event_word_columns(header)
+    dtypes = {'event_id': np.int64, 'user_id': np.int64, 'lat': np.float64, 'lng': np.float64,
+              'city': object, 'state': object, 'country': object}
+    dtypes.update({c: np.float64 for c in word_columns})
+    events_df = pd.read_csv(path, dtype={c: t for c, t in dtypes.items() if c in header})
+    lat = events_df['lat'].to_numpy()
+    lng = events_df['lng'].to_numpy()
+    words = events_df[word_columns].to_numpy()
+    if as_columns:
+        # 'fields' keeps the CSV header order, word columns included.
+        columns = {c: events_df[c].to_numpy() for c in events_df.columns if c not in word_columns}
+        columns['id'] = columns['event_id']
+        columns['words'] = words
+        columns['fields'] = np.array(events_df.columns, dtype=object)
+        return columns
+    has_location = ~(np.isnan(lat) | np.isnan(lng))
     event_info = {}
-    for _, row in events_df.iterrows():
-        eid = row['event_id']
-        location = None
-        if not pd.isna(row['lat']) and not pd.isna(row['lng']):
-            location = [row['lat'], row['lng']]
-        # Extract feature words from columns 9 to 110 (if available)
-        words = row.iloc[9:110].tolist() if len(row) >= 110 else []
-        event = row.to_dict()
-        event['location'] = location
-        event['words'] = words
+    records = events_df.to_dict('records')
+    for event, located, la, ln, w in zip(records, has_location.tolist(), lat.tolist(), lng.tolist(), words.tolist()):
+        eid = event['event_id']
+        event['location'] = [la, ln] if located else None
+        event['words'] = w
         event['id'] = eid  # Add this line to ensure 'id' is present
         event_info[eid] = event
     return event_info
 
 
-def process_friends():
-    friends_df = pd.read_csv("models/data/user_friends.csv")
-    friends = {}
-    for _, row in friends_df.iterrows():
-        uid = row['user']
-        if pd.isna(row['friends']):
-            continue
-        friend_list = [int(u) for u in str(row['friends']).split()]
-        friends[uid] = friend_list
-    return friends
-
-def update_attendance(uid, eid, att_type, attendance_dict):
-    key = (uid, eid)
-    if key not in attendance_dict:
-        attendance_dict[key] = {'uid': uid, 'eid': eid}
-    attendance_dict[key][att_type] = True
-
-def process_attendance():
-    attendance_dict = {}
-    # Process event_attendees.csv
-    event_attendees_df = pd.read_csv("models/data/event_attendees.csv")
-    for _, row in event_attendees_df.iterrows():
-        eid = row['event']
-        for attr in ['yes', 'maybe', 'invited', 'no']:
-            val = row[attr]
-            if pd.isna(val):
-                continue
-            users = [int(u) for u in str(val).split()]
-            for uid in users:
-                update_attendance(uid, eid, attr, attendance_dict)
-    # Process train.csv (which adds extra attendance info)
-    train_df = pd.read_csv("models/data/train.csv", converters={"timestamp": parse})
-    for _, row in train_df.iterrows():
-        uid = row['user']
-        eid = row['event']
-        for attr in ['invited', 'interested', 'not_interested']:
-            if row[attr]:
-                update_attendance(uid, eid, attr, attendance_dict)
+def process_friends(as_columns=False):
+    friends_df = pd.read_csv(FRIENDS_CSV, usecols=['user', 'friends'],
+                             dtype={'user': np.int64, 'friends': object})
+    friends_df = friends_df[friends_df['friends'].notna()]
+    flat, lengths = split_id_lists(friends_df['friends'])
+    uids = friends_df['user'].to_numpy()
+    if as_columns:
+        # CSR layout: the friends of uids[i] are friends[offsets[i]:offsets[i + 1]].
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        return {'uid': uids, 'friends': flat, 'offsets': offsets}
+    friend_lists = np.split(flat, np.cumsum(lengths)[:-1]) if len(uids) else []
+    return {uid: friend_list.tolist() for uid, friend_list in zip(uids.tolist(), friend_lists)}
+
+def dedupe_attendance(uid, eid, flags):
+    """
+    Sort-and-dedupe step over parallel (uid, eid, flags) arrays in file order:
+    keeps the first occurrence of every (uid, eid) pair, in place, with the flags
+    of all its occurrences OR-ed together.
+    """
+    if not len(uid):
+        return uid, eid, flags
+    order = np.lexsort((eid, uid))
+    # Group boundaries, built one column at a time to keep temporaries small.
+    boundary = np.zeros(len(order), dtype=bool)
+    boundary[0] = True
+    for column in (uid, eid):
+        ordered = column[order]
+        boundary[1:] |= ordered[1:] != ordered[:-1]
+        del ordered
+    starts = np.flatnonzero(boundary)
+    del boundary
+    merged = np.bitwise_or.reduceat(flags[order], starts)
+    # The sort is stable, so each group starts at the pair's first position.
+    first = order[starts]
+    del order, starts
+    keep = np.zeros(len(uid), dtype=bool)
+    keep[first] = True
+    combined = np.zeros(len(uid), dtype=np.uint8)
+    combined[first] = merged
+    del first, merged
+    return uid[keep], eid[keep], combined[keep]
+
+def parse_attendees_chunk(chunk):
+    # Pairs appear in file order: row by row, then type by type, then user by user.
+    events = chunk['event'].to_numpy()
+    uids, eids, bits, rows = [], [], [], []
+    for attr in ATTENDEE_TYPES:
+        flat, lengths = split_id_lists(chunk[attr])
+        uids.append(flat)
+        eids.append(np.repeat(events, lengths))
+        bits.append(np.full(len(flat), 1 << ATTENDANCE_TYPES.index(attr), dtype=np.uint8))
+        rows.append(np.repeat(np.arange(len(events)), lengths))
+    order = np.lexsort((np.concatenate(bits), np.concatenate(rows)))
+    return np.concatenate(uids)[order], np.concatenate(eids)[order], np.concatenate(bits)[order]
+
+def parse_train_chunk(chunk):
+    bits = np.zeros(len(chunk), dtype=np.uint8)
+    for attr in TRAIN_TYPES:
+        bits[chunk[attr].to_numpy().astype(bool)] |= 1 << ATTENDANCE_TYPES.index(attr)
+    keep = bits != 0
+    return chunk['user'].to_numpy()[keep], chunk['event'].to_numpy()[keep], bits[keep]
+
+def stream_attendance(max_memory_mb=None):
+    """
+    Parses event_attendees.csv and train.csv chunk by chunk into compact
+    (uid, eid, flags) arrays, where flags has bit k set for ATTENDANCE_TYPES[k].
+    Chunks are sized so that their exploded pairs fit max_memory_mb; each chunk
+    is deduplicated on its own and the concatenation once more at the end.
+    None reads each file in one chunk. Beyond the ceiling, the final dedupe
+    needs roughly 50 bytes per (uid, eid) pair, 17 of which are the result.
+    """
+    budget = None if max_memory_mb is None else max(int(max_memory_mb * 2 ** 20 / PAIR_BYTES), 1)
+    parts = []
+    sources = [
+        (EVENT_ATTENDEES_CSV, ['event'] + ATTENDEE_TYPES,
+         dict({'event': np.int64}, **{t: object for t in ATTENDEE_TYPES}), parse_attendees_chunk),
+        # train.csv adds extra attendance info
+        (TRAIN_CSV, ['user', 'event'] + TRAIN_TYPES,
+         {'user': np.int64, 'event': np.int64}, parse_train_chunk),
+    ]
+    for path, usecols, dtype, parse_chunk in sources:
+        reader = pd.read_csv(path, usecols=usecols, dtype=dtype, iterator=True)
+        rows = None if budget is None else 1000
+        while True:
+            try:
+                chunk = reader.get_chunk(rows)
+            except StopIteration:
+                break
+            uid, eid, flags = parse_chunk(chunk)
+            if budget is not None:
+                # Size the next chunk from this one's pairs per row.
+                rows = max(int(budget * len(chunk) / max(len(uid), 1)), 1)
+            del chunk
+            parts.append(dedupe_attendance(uid, eid, flags))
+        reader.close()
+    # Copy the parts into preallocated arrays, releasing each one as it is copied.
+    total = sum(len(part[0]) for part in parts)
+    columns = (np.empty(total, np.int64), np.empty(total, np.int64), np.empty(total, np.uint8))
+    pos = 0
+    parts.reverse()
+    while parts:
+        part = parts.pop()
+        for column, values in zip(columns, part):
+            column[pos:pos + len(values)] = values
+        pos += len(part[0])
+        del part
+    return dedupe_attendance(*columns)
+
+def attendance_columns(max_memory_mb=ATTENDANCE_MEMORY_MB):
+    """
+    One row per (uid, eid) pair, in order of first appearance in
+    event_attendees.csv then train.csv, with a uint8 flags bitfield over
+    ATTENDANCE_TYPES.
+    """
+    uid, eid, flags = stream_attendance(max_memory_mb)
+    return {'uid': uid, 'eid': eid, 'flags': flags}
+
+def process_attendance(as_columns=False, max_memory_mb=ATTENDANCE_MEMORY_MB):
+    columns = attendance_columns(max_memory_mb)
+    if as_columns:
+        return columns
     # Build indices: attendance_by_uid and attendance_by_eid
     attendance_by_uid = {}
     attendance_by_eid = {}
-    for record in attendance_dict.values():
-        uid = record['uid']
-        eid = record['eid']
+    for uid, eid, flags in zip(columns['uid'].tolist(), columns['eid'].tolist(), columns['flags'].tolist()):
+        record = {'uid': uid, 'eid': eid}
+        for k, attr in enumerate(ATTENDANCE_TYPES):
+            if flags >> k & 1:
+                record[attr] = True
         attendance_by_uid.setdefault(uid, []).append(record)
         attendance_by_eid.setdefault(eid, []).append(record)
     return attendance_by_uid, attendance_by_eid
 
-def fill_missing_location(user_info, event_info, attendance_by_uid, attendance_by_eid):
-    # Get users and events that already have a location.
-    user_sure = {uid: user['location'] for uid, user in user_info.items() if user.get('location')}
-    event_sure = {eid: event['location'] for eid, event in event_info.items() if event.get('location')}
-    # Infer event location from attendance votes
-    for eid, event in event_info.items():
-        if event.get('location'):
-            continue
-        votes = {}
-        if eid in attendance_by_eid:
-            for att in attendance_by_eid[eid]:
-                if 'yes' not in att:
-                    continue
-                user_loc = user_sure.get(att['uid'])
-                if user_loc:
-                    key = tuple(user_loc)
-                    votes[key] = votes.get(key, 0) + 1
-        if votes:
-            best_loc = max(votes.items(), key=lambda x: x[1])[0]
-            event_info[eid]['location'] = list(best_loc)
-    # Infer user location from events attended
-    for uid, user in user_info.items():
-        if user.get('location'):
-            continue
-        votes = {}
-        if uid in attendance_by_uid:
-            for att in attendance_by_uid[uid]:
-                event_loc = event_sure.get(att['eid'])
-                if event_loc:
-                    key = tuple(event_loc)
-                    votes[key] = votes.get(key, 0) + 1
-        if votes:
-            best_loc = max(votes.items(), key=lambda x: x[1])[0]
-            user_info[uid]['location'] = list(best_loc)
+def known_points(mapping):
+    # (lat, lng) of every record in iteration order, NaN where the location is unknown.
+    if hasattr(mapping, 'point_values'):
+        return mapping.point_values('location')
+    points = np.full((len(mapping), 2), np.nan)
+    for i, record in enumerate(mapping.values()):
+        if record.get('location'):
+            points[i] = record['location'][:2]
+    return points
+
+def attendance_pairs(attendance):
+    # (uids, eids, yes) over every record of an attendance index in its order,
+    # read from the columns when possible.
+    arrays = getattr(attendance, 'arrays', None)
+    if arrays is not None:
+        uids, eids, kinds = arrays()
+        return uids, eids, kinds['yes']
+    records = [record for records in attendance.values() for record in records]
+    return (pd.Index([record['uid'] for record in records]), pd.Index([record['eid'] for record in records]),
+            np.array(['yes' in record for record in records], dtype=bool))
+
+def top_votes(rows, votes):
+    """
+    Majority vote per row over (row, vote) pairs listed in voting order. Returns
+    the rows that got a vote and their winning votes; a tie goes to the vote
+    cast first, as max() over a dict of counts filled in that order does.
+    """
+    if not len(rows):
+        return rows, votes
+    n = int(votes.max()) + 1
+    keys, first, counts = np.unique(rows * n + votes, return_index=True, return_counts=True)
+    key_rows = keys // n
+    order = np.lexsort((first, -counts, key_rows))
+    winners = order[np.r_[True, key_rows[order][1:] != key_rows[order][:-1]]]
+    return key_rows[winners], keys[winners] % n
+
+def fill_missing_location(user_info, event_info, attendance_by_uid, attendance_by_eid,
+                          rounds=LOCATION_ROUNDS, update_events=True):
+    """
+    Infers missing user and event locations by label propagation over the
+    attendance pairs, every distinct known location being a label. In each
+    round an event without a location takes the label most of its 'yes'
+    attendees have, and a user without one the label of most of the events
+    they responded to, both voting with the labels known at the start of the
+    round; the first round is thus the former single pass. Rounds repeat until
+    none adds a location, up to rounds. update_events=False only writes back
+    user locations.
+    """
+    start = time.time()
+    users, events = (pd.Index(m.key_array() if hasattr(m, 'key_array') else list(m)) for m in (user_info, event_info))
+    points = np.concatenate([known_points(user_info), known_points(event_info)])
+    located = ~np.isnan(points).any(axis=1)
+    # Points as complex numbers sort and deduplicate by (lat, lng) in one 1-D pass.
+    labels, inverse = np.unique(points[located] @ np.array([1, 1j]), return_inverse=True)
+    labels = np.column_stack([labels.real, labels.imag])
+    label = np.full(len(points), -1, dtype=np.int64)
+    label[located] = inverse
+    user_label, event_label = label[:len(users)], label[len(users):]
+    user_known, event_known = user_label >= 0, event_label >= 0
+
+    # (user, event) positions of the records, by user and by event, each in its index's order.
+    pairs = []
+    for attendance in (attendance_by_uid, attendance_by_eid):
+        uids, eids, yes = attendance_pairs(attendance)
+        rows, cols = users.get_indexer(uids), events.get_indexer(eids)
+        keep = (rows >= 0) & (cols >= 0)
+        pairs.append((rows[keep], cols[keep], yes[keep]))
+    (user_rows, user_cols, _), (event_rows, event_cols, event_yes) = pairs
+    event_rows, event_cols = event_rows[event_yes], event_cols[event_yes]
+
+    for round_ in range(1, rounds + 1):
+        tick = time.time()
+        votes = (user_label[user_rows] < 0) & (event_label[user_cols] >= 0)
+        new_users = top_votes(user_rows[votes], event_label[user_cols[votes]])
+        votes = (event_label[event_cols] < 0) & (user_label[event_rows] >= 0)
+        new_events = top_votes(event_cols[votes], user_label[event_rows[votes]])
+        user_label[new_users[0]] = new_users[1]
+        event_label[new_events[0]] = new_events[1]
+        print(f"[LOCATION] Round {round_}: +{len(new_users[0])} users, +{len(new_events[0])} events, "
+              f"{(user_label >= 0).mean():.1%} of users and {(event_label >= 0).mean():.1%} of events "
+              f"located ({time.time() - tick:.2f}s)")
+        if not len(new_users[0]) and not len(new_events[0]):
+            break
+
+    inferred = [(user_info, users, user_label, user_known)]
+    if update_events:
+        inferred.append((event_info, events, event_label, event_known))
+    for mapping, keys, label, known in inferred:
+        for i in np.flatnonzero((label >= 0) & ~known).tolist():
+            # Assigned back, so mappings over cached columns keep the edit.
+            record = mapping[keys[i]]
+            record['location'] = labels[label[i]].tolist()
+            mapping[keys[i]] = record
+    print(f"[LOCATION] Inferred {((user_label >= 0) & ~user_known).sum()} user and "
+          f"{((event_label >= 0) & ~event_known).sum()} event locations in {time.time() - start:.2f}s")
 
 def process_and_update_ages(user_info):
     for uid, user in user_info.items():
@@ -130,7 +355,8 @@ def process_and_update_ages(user_info):
                 age = 2013 - year
         except:
             age = None
-        user_info[uid]['age'] = age
+        user['age'] = age
+        user_info[uid] = user
 
 def process_data():
     user_info = process_users()
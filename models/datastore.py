@@ -0,0 +1,393 @@
+import os
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from models.data_processing import process_users, process_events, process_friends, process_attendance, fill_missing_location, process_and_update_ages
+from models.data_processing import USERS_CSV, EVENTS_CSV, FRIENDS_CSV, EVENT_ATTENDEES_CSV, TRAIN_CSV
+from models.manifest import check_manifest, stamp_manifest, remove_manifest, source_fingerprints
+from models.column_cache import save_user_info, load_user_info, save_event_info, load_event_info, save_friends, load_friends, save_attendance, load_attendance, save_ids, load_ids
+from models.ids import build_id_registry
+from models.attendance import build_attendance_matrices, RESPONSE_TYPES
+from models.attendance_store import AttendanceStore, AttendanceRecords
+from models.memo import clear as clear_memos
+from models.event_counts import build_event_counters
+from models.word_vectors import build_event_word_matrix
+from models.spatial import build_spatial_index
+from models.coattendance import CoAttendanceIndex, build_coattendance_index
+
+# --- Caching Functions ---
+# Digest of every cache artifact loaded or built in this process, by path.
+cache_digests = {}
+
+def cached_artifact(path, load, build, sources=(), upstream=()):
+    """
+    Loads a cache artifact if its manifest still matches the source files and
+    the upstream artifacts (loaded earlier in this process) it was built from.
+    Otherwise build(path) rewrites it and a new manifest is stamped, which in
+    turn invalidates every artifact that lists this one upstream.
+    """
+    inputs = {name: cache_digests[name] for name in upstream}
+    digest = check_manifest(path, list(sources), inputs)
+    if digest is not None:
+        data = load(path)
+        print(f"[CACHE] Loaded cached data from {path}")  # Prints: Data loaded from path
+    else:
+        print(f"[CACHE] Rebuilding {path}")
+        remove_manifest(path)
+        fingerprints = source_fingerprints(sources)
+        build(path)
+        data = load(path)
+        digest = stamp_manifest(path, fingerprints, inputs)
+        print(f"[CACHE] Data cached to {path}")  # Prints: Data has been saved to path
+    cache_digests[path] = digest
+    return data
+
+# Processes rebuilding stale CSV caches at startup; 1 rebuilds them one after another.
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", 4))
+
+def build_users(path):
+    save_user_info(path, process_users(as_columns=True))
+
+def build_event_info(path):
+    save_event_info(path, process_events(as_columns=True))
+
+def build_friends(path):
+    save_friends(path, process_friends(as_columns=True))
+
+def build_attendance(path):
+    save_attendance(path, process_attendance(as_columns=True))
+
+# The CSV caches that do not depend on each other: name -> (path, load, build, sources).
+LOAD_STAGES = {
+    'users': ('cache_users', load_user_info, build_users, [USERS_CSV]),
+    'events': ('cache_event_info_sampled', load_event_info, build_event_info, [EVENTS_CSV]),
+    'friends': ('cache_friends', load_friends, build_friends, [FRIENDS_CSV]),
+    'attendance': ('cache_attendance', load_attendance, build_attendance, [EVENT_ATTENDEES_CSV, TRAIN_CSV]),
+}
+
+def load_stage(name):
+    path, load, build, sources = LOAD_STAGES[name]
+    return cached_artifact(path, load, build, sources)
+
+def stage_stale(name):
+    path, _, _, sources = LOAD_STAGES[name]
+    return check_manifest(path, sources, {}) is None
+
+def rebuild_stage(name):
+    # Runs in a pool worker: writes the cache and its manifest, returns only the wall time.
+    start = time.time()
+    load_stage(name)
+    return time.time() - start
+
+def load_stages(workers=LOAD_WORKERS):
+    """
+    Loads every independent stage and returns {name: data}. Stale stages are
+    first rebuilt side by side in a forked process pool, so a cold start takes as
+    long as the slowest CSV rather than all of them; the parent then only maps
+    the fresh caches. Each stage's wall time is printed.
+    """
+    timings = {}
+    stale = [name for name in LOAD_STAGES if stage_stale(name)]
+    workers = min(workers, len(stale), os.cpu_count() or 1)
+    if workers > 1:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            timings.update(zip(stale, pool.map(rebuild_stage, stale)))
+    data = {}
+    for name in LOAD_STAGES:
+        start = time.time()
+        data[name] = load_stage(name)
+        timings[name] = timings.get(name, 0) + time.time() - start
+    print("[LOAD] " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+    return data
+
+def get_user_info(users, event_info, attendance_by_uid, attendance_by_eid):
+    # Users with locations inferred from the events they attend and ages; rebuilt
+    # when users, events or attendance change.
+    def infer(path):
+        # Inferred event locations only feed the user side: event_info is cached
+        # from events.csv alone, so writing them back would not survive a reload.
+        fill_missing_location(users, event_info, attendance_by_uid, attendance_by_eid, update_events=False)
+        process_and_update_ages(users)
+        save_user_info(path, users)
+
+    return cached_artifact('cache_user_info', load_user_info, infer,
+                           upstream=['cache_users', 'cache_event_info_sampled', 'cache_attendance'])
+
+def get_ids(user_info, event_info, attendance_by_uid, friends, path='cache_ids'):
+    # The shared id registry; positions are stable for as long as the cached data is.
+    return cached_artifact(path, load_ids,
+                           lambda path: save_ids(path, build_id_registry(user_info, event_info, attendance_by_uid, friends)),
+                           upstream=['cache_user_info', 'cache_event_info_sampled', 'cache_attendance', 'cache_friends'])
+
+def get_coattendance_index(matrices, path='cache_coattendance'):
+    # Saved rows are mapped onto the matrices' event positions on load, so a new
+    # id registry (e.g. after a friends-only change) does not force a rebuild.
+    # Live updates saved by record_attendance live in a delta file next to it and
+    # are replayed onto the index they were made on; a rebuild drops them.
+    index = cached_artifact(path, lambda path: CoAttendanceIndex.load(path, matrices.events),
+                            lambda path: build_coattendance_index(matrices).save(path),
+                            upstream=['cache_event_info_sampled', 'cache_attendance'])
+    index.digest = cache_digests[path]
+    index.replay_delta(path)
+    return index
+
+def get_full_data(workers=LOAD_WORKERS):
+    # The independent files load concurrently; location and age inference wait for all of them.
+    start = time.time()
+    data = load_stages(workers)
+    attendance = data['attendance']
+    tick = time.time()
+    user_info = get_user_info(data['users'], data['events'], attendance.by_user(), attendance.by_event())
+    print(f"[LOAD] user_info {time.time() - tick:.2f}s, total {time.time() - start:.2f}s")
+    return user_info, data['events'], attendance.by_user(), attendance.by_event(), data['friends']
+
+# --- MongoDB ---
+def load_mongo_data(db):
+    """
+    Loads users, events, attendance and friends from the D2K MongoDB collections.
+    Attendance documents ({'user', 'event', 'response', ...}) are turned into
+    attendance records ({'uid', 'eid', <response>: True, ...}).
+    """
+    users = {}
+    for doc in db.user_info.find():
+        uid = doc.get("user_id")
+        if uid is not None:
+            users[uid] = doc
+
+    # Load event_info from MongoDB into a dictionary keyed by event_id.
+    events = {}
+    for doc in db.event_info.find():
+        eid = doc.get("event_id")
+        if eid is not None:
+            # Infer location from lat and lng fields if available
+            if doc.get("lat") is not None and doc.get("lng") is not None:
+                doc["location"] = [doc["lat"], doc["lng"]]
+            else:
+                doc["location"] = None
+            # Ensure words field exists (should be a list)
+            if "words" not in doc:
+                doc["words"] = []
+            doc["id"] = eid
+            events[eid] = doc
+
+    # Build attendance indices
+    att_by_uid = {}
+    att_by_eid = {}
+    for doc in db.attendance.find():
+        record = mongo_attendance_record(doc)
+        if record is None:
+            continue
+        att_by_uid.setdefault(record["uid"], []).append(record)
+        att_by_eid.setdefault(record["eid"], []).append(record)
+
+    # Build friends dictionary: each document should have a "user" field and a "friends" list.
+    friends_dict = {}
+    for doc in db.friends.find():
+        uid = doc.get("user")
+        if uid is not None:
+            friends_dict[uid] = doc.get("friends", [])
+
+    return users, events, att_by_uid, att_by_eid, friends_dict
+
+def mongo_attendance_record(doc):
+    # Attendance record for one attendance document; None if it lacks a user or event.
+    uid = doc.get("user")
+    eid = doc.get("event")
+    if uid is None or eid is None:
+        return None
+    record = {"uid": uid, "eid": eid}
+    for kind in RESPONSE_TYPES:
+        if doc.get(kind) or doc.get("response") == kind:
+            record[kind] = True
+    if "timestamp" in doc:
+        record["timestamp"] = doc["timestamp"]
+    return record
+
+# --- Data store ---
+class ReadWriteLock:
+    """
+    Many readers or one writer. A waiting writer holds back new readers, so a
+    steady stream of requests cannot starve the write path. Not reentrant: a
+    thread holding either side must not take the lock again.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+class DataStore:
+    """
+    The users, events, attendance and friends the recommender works on, and the
+    indexes derived from them. Nothing is loaded up front: loader() runs on the
+    first access to a data attribute and returns (user_info, event_info,
+    attendance_by_uid, attendance_by_eid, friends), and each index is built the
+    first time it is read. Stores are independent, so several (e.g. per-city
+    shards, or a tiny one in a test) can live in one process.
+
+    Attendance is held in an AttendanceStore; attendance dicts from the loader
+    are packed into one, and attendance_by_uid / attendance_by_eid are views
+    over it.
+
+    Every index addresses users and events by the dense positions of one
+    IdRegistry (ids), so positions can be passed between indexes and turned back
+    into external ids only at the API boundary.
+
+    The indexes are updated in place by live writes (record_attendance,
+    register_event), which run under writing(); request-path reads of them run
+    under reading(), so a request never sees a half-applied write.
+
+    ids_path and coattendance_path persist the registry and the co-attendance
+    index, with their manifests, for stores whose data comes from the CSV caches.
+    """
+    def __init__(self, loader, coattendance_path=None, ids_path=None):
+        self.loader = loader
+        self.coattendance_path = coattendance_path
+        self.ids_path = ids_path
+        self._data = None
+        self._indexes = {}
+        self._lock = threading.RLock()
+        self._rw_lock = ReadWriteLock()
+
+    @classmethod
+    def from_csv(cls, workers=LOAD_WORKERS):
+        # The columnar caches of models/data/*.csv, rebuilt when their sources change.
+        return cls(lambda: get_full_data(workers), coattendance_path='cache_coattendance', ids_path='cache_ids')
+
+    @classmethod
+    def from_mongo(cls, db):
+        return cls(lambda: load_mongo_data(db))
+
+    @classmethod
+    def from_dicts(cls, user_info, event_info, attendance_by_uid, attendance_by_eid, friends):
+        return cls(lambda: (user_info, event_info, attendance_by_uid, attendance_by_eid, friends))
+
+    def load(self):
+        # Loads the data now rather than on first use; returns the store.
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    user_info, event_info, attendance_by_uid, _, friends = self.loader()
+                    attendance = attendance_by_uid.store if isinstance(attendance_by_uid, AttendanceRecords) \
+                        else AttendanceStore.from_records(attendance_by_uid)
+                    self._data = (user_info, event_info, attendance, friends)
+                    print("[INFO] All data loaded successfully.")  # Indicates data processing and caching completed
+        return self
+
+    def build_indexes(self):
+        # Builds every derived index now, e.g. before forking workers that share them.
+        for name in ['ids', 'attendance_matrices', 'coattendance_index', 'event_counters', 'event_words', 'spatial_index']:
+            getattr(self, name)
+        return self
+
+    def reading(self):
+        return self._rw_lock.read()
+
+    def writing(self):
+        return self._rw_lock.write()
+
+    def reload(self):
+        # Drops the data, the derived indexes and every memoized result; the next access reloads.
+        with self._lock:
+            self._data = None
+            self._indexes = {}
+        clear_memos()
+
+    @property
+    def user_info(self):
+        return self.load()._data[0]
+
+    @property
+    def event_info(self):
+        return self.load()._data[1]
+
+    @property
+    def attendance(self):
+        return self.load()._data[2]
+
+    @property
+    def attendance_by_uid(self):
+        return self.attendance.by_user()
+
+    @property
+    def attendance_by_eid(self):
+        return self.attendance.by_event()
+
+    @property
+    def friends(self):
+        return self.load()._data[3]
+
+    def _index(self, name, build):
+        if name not in self._indexes:
+            with self._lock:
+                if name not in self._indexes:
+                    self._indexes[name] = build()
+        return self._indexes[name]
+
+    @property
+    def ids(self):
+        # Dense int32 positions of every user and event, shared by the indexes below.
+        def build():
+            if self.ids_path is None:
+                return build_id_registry(self.user_info, self.event_info, self.attendance_by_uid, self.friends)
+            return get_ids(self.user_info, self.event_info, self.attendance_by_uid, self.friends, self.ids_path)
+        return self._index('ids', build)
+
+    @property
+    def attendance_matrices(self):
+        # Sparse user x event matrices per response type, over the shared ids.
+        return self._index('attendance_matrices', lambda: build_attendance_matrices(
+            self.attendance_by_uid, ids=self.ids))
+
+    @property
+    def coattendance_index(self):
+        def build():
+            if self.coattendance_path is None:
+                return build_coattendance_index(self.attendance_matrices)
+            return get_coattendance_index(self.attendance_matrices, self.coattendance_path)
+        return self._index('coattendance_index', build)
+
+    @property
+    def event_counters(self):
+        # Per-event response counts, kept current by record_attendance.
+        return self._index('event_counters', lambda: build_event_counters(self.attendance_matrices))
+
+    @property
+    def event_words(self):
+        # Log-scaled, L2-normalized event word vectors for the prototype similarity features.
+        return self._index('event_words', lambda: build_event_word_matrix(self.event_info, self.ids.events))
+
+    @property
+    def spatial_index(self):
+        # Lat/lng grid over event locations for distance features and radius queries.
+        return self._index('spatial_index', lambda: build_spatial_index(self.event_info, self.ids.events))
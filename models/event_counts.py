@@ -0,0 +1,51 @@
+import numpy as np
+from models.ids import IdIndex, grow
+from models.attendance import RESPONSE_TYPES
+
+class EventCounters:
+    """
+    Per-event response counts, one int32 column per response type, stored as a
+    NumPy array indexed by dense event position. Counts do not depend on the user,
+    so they are computed once at load time and bumped in place on every write.
+    """
+    def __init__(self, events=None, counts=None):
+        self.events = events if events is not None else IdIndex()
+        if counts is None:
+            counts = np.zeros((len(self.events), len(RESPONSE_TYPES)), dtype=np.int32)
+        self.counts = counts
+        self.column = {kind: k for k, kind in enumerate(RESPONSE_TYPES)}
+
+    def add(self, eid, kinds):
+        # O(1) amortized: the array grows by doubling when a new event appears.
+        row = self.events.add(eid)
+        self.counts = grow(self.counts, row + 1, 0)
+        for kind in kinds:
+            self.counts[row, self.column[kind]] += 1
+
+    def add_record(self, record):
+        self.add(record['eid'], [kind for kind in RESPONSE_TYPES if record.get(kind)])
+
+    def get(self, eids, kinds=RESPONSE_TYPES):
+        # Counts for many events at once; unknown events count zero.
+        rows = self.events.lookup(list(eids))
+        known = (rows >= 0) & (rows < len(self.counts))
+        out = np.zeros((len(rows), len(kinds)))
+        out[known] = self.counts[rows[known]][:, [self.column[kind] for kind in kinds]]
+        return out
+
+    def top(self, kinds, limit):
+        # The limit events with the highest summed counts, highest first.
+        score = self.counts[:len(self.events), [self.column[kind] for kind in kinds]].sum(axis=1)
+        if limit < len(score):
+            rows = np.argpartition(-score, limit)[:limit]
+        else:
+            rows = np.arange(len(score))
+        rows = rows[np.argsort(-score[rows], kind='stable')]
+        return [self.events.external(r) for r in rows]
+
+def build_event_counters(matrices):
+    # Column sums of each response matrix, sharing the matrices' event index.
+    counts = np.zeros((len(matrices.events), len(RESPONSE_TYPES)), dtype=np.int32)
+    for k, kind in enumerate(RESPONSE_TYPES):
+        counts[:, k] = np.asarray(matrices.csr(kind).sum(axis=0)).ravel()
+    return EventCounters(matrices.events, counts)
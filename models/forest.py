@@ -0,0 +1,92 @@
+import numpy as np
+
+def expit(x):
+    # Logistic sigmoid without overflow warnings; scipy.special costs a noticeable import.
+    return np.exp(-np.logaddexp(0, -x))
+
+class CompiledForest:
+    """
+    A fitted RandomForestClassifier flattened into contiguous arrays, one entry
+    per node of every tree: feature, threshold, missing_left, leaf, the class-1
+    probability value, and children, where node i's left and right child are
+    at 2i and 2i + 1 (leaves point to themselves). roots holds each tree's
+    first node. A batch walks all (row, tree) pairs together one level at a
+    time, dropping the pairs that reached a leaf, so the work follows the
+    actual path lengths.
+
+    columns maps those names to arrays; they are only read, so memory-mapped
+    arrays work as they are.
+    """
+    def __init__(self, columns, depth):
+        self.columns = columns
+        self.depth = depth
+        for name in ['feature', 'threshold', 'children', 'missing_left', 'leaf', 'value', 'roots']:
+            setattr(self, name, columns[name])
+        self.has_missing = bool(self.missing_left.any())
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        parts = {name: [] for name in ['feature', 'threshold', 'children', 'missing_left', 'leaf', 'value']}
+        roots, depth, offset = [], 0, 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            leaf = tree.children_left < 0
+            # Class-1 share of the samples in each node, as DecisionTreeClassifier.predict_proba reports it.
+            value = tree.value[:, 0, :]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                proba = value[:, 1] / value.sum(axis=1)
+            parts['feature'].append(np.where(leaf, 0, tree.feature))
+            parts['threshold'].append(np.where(leaf, np.inf, tree.threshold))
+            parts['children'].append(np.column_stack([np.where(leaf, nodes, tree.children_left),
+                                                      np.where(leaf, nodes, tree.children_right)]).ravel() + offset)
+            missing_left = getattr(tree, 'missing_go_to_left', None)
+            parts['missing_left'].append(np.zeros(tree.node_count, dtype=bool) if missing_left is None
+                                         else np.asarray(missing_left, dtype=bool) & ~leaf)
+            parts['leaf'].append(leaf)
+            parts['value'].append(proba)
+            roots.append(offset)
+            depth = max(depth, tree.max_depth)
+            offset += tree.node_count
+        columns = {name: np.concatenate(values) for name, values in parts.items()}
+        # intp node positions index without a conversion.
+        for name, dtype in [('feature', np.int32), ('threshold', np.float64), ('children', np.intp),
+                            ('value', np.float64)]:
+            columns[name] = columns[name].astype(dtype)
+        columns['roots'] = np.array(roots, dtype=np.intp)
+        return cls(columns, depth)
+
+    def predict(self, X):
+        # Mean class-1 probability over the trees for every row of X. Features are
+        # rounded to float32 first, like sklearn's tree traversal does.
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32)).astype(np.float64)
+        n, width = X.shape
+        flat = X.ravel()
+        node = np.tile(self.roots, n)
+        offset = np.repeat(np.arange(n, dtype=np.intp) * width, len(self.roots))
+        active = np.flatnonzero(~self.leaf[node])
+        while len(active):
+            current = node[active]
+            x = flat[offset[active] + self.feature[current]]
+            right = ~(x <= self.threshold[current])
+            if self.has_missing:
+                # NaN compares false, so it goes right unless the split sends missing values left.
+                missing = np.flatnonzero(np.isnan(x))
+                right[missing] = ~self.missing_left[current[missing]]
+            current = self.children[2 * current + right]
+            node[active] = current
+            active = active[~self.leaf[current]]
+        return self.value[node].reshape(n, len(self.roots)).mean(axis=1)
+
+class CompiledLogistic:
+    # Binary LogisticRegression as a coefficient vector and intercept.
+    def __init__(self, coef, intercept):
+        self.coef = coef
+        self.intercept = intercept
+
+    @classmethod
+    def from_sklearn(cls, lr):
+        return cls(np.asarray(lr.coef_, dtype=np.float64).ravel(), float(lr.intercept_[0]))
+
+    def predict(self, X):
+        return expit(np.asarray(X, dtype=np.float64) @ self.coef + self.intercept)
@@ -0,0 +1,96 @@
+import numpy as np
+
+def id_column(ids):
+    # int64 when every id is an int (the CSV ids), objects otherwise, so no id changes type.
+    if all(isinstance(ext, (int, np.integer)) for ext in ids):
+        return np.array(ids, dtype=np.int64)
+    return np.array(ids, dtype=object)
+
+def grow(array, rows, fill):
+    """
+    array with at least rows rows, the new ones set to fill. Capacity at least
+    doubles, so arrays indexed by positions that are added one at a time grow in
+    O(1) amortized.
+    """
+    if rows <= len(array):
+        return array
+    extra = np.full((max(rows, 2 * len(array)) - len(array),) + array.shape[1:], fill, dtype=array.dtype)
+    return np.concatenate([array, extra])
+
+class IdIndex:
+    """
+    Maps external ids (Kaggle int64 ids, generated strings, usernames) to dense
+    int positions in insertion order, so per-user and per-event data can live in
+    arrays and sparse matrices.
+    """
+    def __init__(self, ids=()):
+        self._ids = list(ids)
+        self._pos = {ext: pos for pos, ext in enumerate(self._ids)}
+        if len(self._pos) != len(self._ids):
+            # Repeated ids keep their first position.
+            ids, self._ids, self._pos = self._ids, [], {}
+            for ext in ids:
+                self.add(ext)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, ext):
+        return ext in self._pos
+
+    def add(self, ext):
+        pos = self._pos.get(ext)
+        if pos is None:
+            # Appended before it is mapped, so a reader that finds the position can resolve it.
+            pos = len(self._ids)
+            self._ids.append(ext)
+            self._pos[ext] = pos
+        return pos
+
+    def add_many(self, ids):
+        # Positions for an array of ids; new ones are added in order of first appearance.
+        unique, first, inverse = np.unique(np.asarray(ids), return_index=True, return_inverse=True)
+        for ext in unique[np.argsort(first)].tolist():
+            self.add(ext)
+        return self.lookup(unique.tolist())[inverse.ravel()]
+
+    def get(self, ext, default=-1):
+        return self._pos.get(ext, default)
+
+    def lookup(self, ids):
+        # Positions for many ids at once; -1 marks ids that are not indexed.
+        return np.fromiter((self._pos.get(ext, -1) for ext in ids), dtype=np.int32, count=len(ids))
+
+    def external(self, pos):
+        return self._ids[pos]
+
+    @property
+    def ids(self):
+        return self._ids
+
+class IdRegistry:
+    """
+    The user and event id spaces shared by every index and matrix, so a dense
+    position means the same user or event everywhere. Users follow user_info
+    order and events event_info order, each followed by ids only seen in
+    attendance (and, for users, in the friends index), then by ids registered
+    live.
+    """
+    def __init__(self, users=None, events=None):
+        self.users = users if users is not None else IdIndex()
+        self.events = events if events is not None else IdIndex()
+
+def build_id_registry(user_info, event_info, attendance_by_uid, friends=()):
+    registry = IdRegistry(IdIndex(user_info), IdIndex(event_info))
+    arrays = getattr(attendance_by_uid, 'arrays', None)
+    if arrays is not None:
+        uids, eids, _ = arrays()
+    else:
+        records = [record for records in attendance_by_uid.values() for record in records]
+        uids, eids = [r['uid'] for r in records], [r['eid'] for r in records]
+    if len(uids):
+        registry.users.add_many(uids)
+        registry.events.add_many(eids)
+    for uid in friends:
+        registry.users.add(uid)
+    return registry
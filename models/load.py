@@ -26,63 +26,32 @@ friends_db = db.friends
 # -------------------------------
 # Import Recommendation Logic
 # -------------------------------
-from recommendation import process_events_for_user
+from recommendation import record_attendance, register_event as register_recommendation_event
+from recommendation import generate_candidates, load_model_artifact, interaction_example, rank_events
+from datastore import DataStore, mongo_attendance_record
+from online import OnlineLR, ONLINE_LEARNING
 
+# The compiled artifact is preferred; loading it fails if the feature layout changed since training.
+MODEL_ARTIFACT = "trained_model.model"
 MODEL_FILENAME = "trained_model.pkl"
-if os.path.exists(MODEL_FILENAME):
+if os.path.exists(MODEL_ARTIFACT):
+    model = load_model_artifact(MODEL_ARTIFACT)
+    print(f"Loaded model from {MODEL_ARTIFACT}")
+elif os.path.exists(MODEL_FILENAME):
     with open(MODEL_FILENAME, "rb") as f:
         model = pickle.load(f)
     print(f"Loaded model from {MODEL_FILENAME}")
 else:
     model = None
     print("Trained model not found.")
+# Updates the model's LR from live interactions.
+online = OnlineLR(model).start() if model is not None and ONLINE_LEARNING else None
 
 # -------------------------------
-# Helper: Load full data from MongoDB
+# Data: loaded from MongoDB on first use
 # -------------------------------
-def load_full_data_mongo():
-    users = {}
-    for doc in user_info_db.find():
-        uid = doc.get("user_id")
-        if uid is not None:
-            users[uid] = doc
-
-    # Load event_info from MongoDB into a dictionary keyed by event_id.
-    events = {}
-    for doc in event_info_db.find():
-        eid = doc.get("event_id")
-        if eid is not None:
-            # Infer location from lat and lng fields if available
-            if doc.get("lat") is not None and doc.get("lng") is not None:
-                doc["location"] = [doc["lat"], doc["lng"]]
-            else:
-                doc["location"] = None
-            # Ensure words field exists (should be a list)
-            if "words" not in doc:
-                doc["words"] = []
-            events[eid] = doc
-
-    # Build attendance indices
-    att_by_uid = {}
-    att_by_eid = {}
-    for doc in attendance_db.find():
-        uid = doc.get("user")
-        eid = doc.get("event")
-        if uid is None or eid is None:
-            continue
-        att_by_uid.setdefault(uid, []).append(doc)
-        att_by_eid.setdefault(eid, []).append(doc)
-
-    # Build friends dictionary: each document should have a "user" field and a "friends" list.
-    friends_dict = {}
-    for doc in friends_db.find():
-        uid = doc.get("user")
-        if uid is not None:
-            friends_dict[uid] = doc.get("friends", [])
-    
-    return users, events, att_by_uid, att_by_eid, friends_dict
-
-user_info, event_info, attendance_by_uid, attendance_by_eid, friends = load_full_data_mongo()
+# Kept current by the write routes below, so recommendations need no reload.
+store = DataStore.from_mongo(db)
 app = Flask(__name__)
 
 # -------------------------------
@@ -117,9 +86,8 @@ def register():
 
     try:
         user_info_db.insert_one(data)
-        # Update the global variable
-        global user_info
-        user_info[data["user_id"]] = data
+        # Update the in-memory users
+        store.user_info[data["user_id"]] = data
         return jsonify({"status": "success", "user": data}), 201
     except Exception as e:
         return jsonify({"status": "fail", "message": str(e)}), 500
@@ -152,15 +120,16 @@ def register_event():
 
     try:
         event_info_db.insert_one(data)
-        # Update global event_info: compute location if lat/lng provided.
-        global event_info
+        # Update the in-memory events: compute location if lat/lng provided.
         if data.get("lat") is not None and data.get("lng") is not None:
             data["location"] = [data["lat"], data["lng"]]
         else:
             data["location"] = None
         if "words" not in data:
             data["words"] = []
-        event_info[data["event_id"]] = data
+        data["id"] = data["event_id"]
+        # Adds the event to event_info and to the recommender's feature indexes.
+        register_recommendation_event(store, data)
         return jsonify({"status": "success", "event": data}), 201
     except Exception as e:
         return jsonify({"status": "fail", "message": str(e)}), 500
@@ -192,9 +161,8 @@ def update_friends():
         result = friends_db.update_one({"user": data["user"]},
                                        {"$set": {"friends": data["friends"]}},
                                        upsert=True)
-        # Update the global friends variable
-        global friends
-        friends[data["user"]] = data["friends"]
+        # Update the in-memory friends
+        store.friends[data["user"]] = data["friends"]
         return jsonify({"status": "success", "data": data}), 200
     except Exception as e:
         return jsonify({"status": "fail", "message": str(e)}), 500
@@ -228,14 +196,17 @@ def interaction():
             return jsonify({"status": "fail", "message": f"Missing field: {field}"}), 400
 
     try:
+        record = mongo_attendance_record(data)
+        # The training example uses the features from before this interaction. It is
+        # built before the insert, so a failure here cannot leave the interaction
+        # stored in Mongo but missing from the in-memory indexes.
+        example = interaction_example(store, record) if online is not None else None
         # Insert the interaction as a new attendance record.
         attendance_db.insert_one(data)
-        # Optionally, update the global attendance indices.
-        global attendance_by_uid, attendance_by_eid
-        uid = data["user"]
-        eid = data["event"]
-        attendance_by_uid.setdefault(uid, []).append(data)
-        attendance_by_eid.setdefault(eid, []).append(data)
+        # Feeds the attendance indexes and drops the stale memoized similarities.
+        record_attendance(store, record)
+        if example is not None:
+            online.add(*example)
         return jsonify({"status": "success", "interaction": data}), 201
     except Exception as e:
         return jsonify({"status": "fail", "message": str(e)}), 500
@@ -250,23 +221,23 @@ def recommendations():
     
     Expected JSON input:
     {
-        "user_id": 1
+        "user_id": 1,
+        "candidate_limits": {"geo": 200, "popularity": 0}   // Optional per-source overrides
     }
     
     Process:
-    - Loads the full data from MongoDB (users, events, attendance, friends) and updates the global variables.
-    - Builds a candidate event dictionary for the user.
-      Here, for each event in the event_info collection, we assume a default tuple (invited_flag, timestamp)
-      for simplicity.
-    - Calls the existing recommendation logic (process_events_for_user) which computes feature vectors for each event.
-    - Replaces None values in the feature vector with 0.
-    - Uses the pre-trained model to predict scores for each event and sorts them in descending order.
+    - Retrieves candidate events for the user from cheap sources (geo proximity, friends' events,
+      co-attendance neighbours, global popularity). Each candidate gets a default
+      (invited_flag, timestamp) for simplicity.
+    - Ranks them with the cascade (rank_events): the pre-trained model's LR scores every candidate
+      from the few features it needs, then the full features and forest rescore the best ones.
     
     Response:
     {
         "status": "success",
         "user_id": 1,
-        "recommendations": [list of event IDs sorted by predicted score]
+        "recommendations": [list of event IDs sorted by predicted score],
+        "candidate_sources": {source: number of candidates it contributed}
     }
     """
     data = request.get_json()
@@ -274,43 +245,29 @@ def recommendations():
     if user_id is None:
         return jsonify({"status": "fail", "message": "Missing user_id"}), 400
 
-    if user_id not in user_info:
+    if user_id not in store.user_info:
         return jsonify({"status": "fail", "message": "User not found"}), 404
 
-    # Reload full data from MongoDB (in case there were updates)
-    global user_info, event_info, attendance_by_uid, attendance_by_eid, friends
-    user_info, event_info, attendance_by_uid, attendance_by_eid, friends = load_full_data_mongo()
-
-    # Build candidate event dictionary for the recommendation logic.
-    # For each event, we use a default tuple: (invited_flag=0, timestamp=0).
-    e_dict = {}
-    for eid in event_info:
-        e_dict[eid] = (0, 0)
-
-    # Compute feature vectors for each candidate event using your existing logic.
-    features_dict = process_events_for_user(user_id, e_dict)
+    try:
+        limits = {name: int(value) for name, value in (data.get("candidate_limits") or {}).items()}
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({"status": "fail", "message": "candidate_limits must map source names to integers"}), 400
 
-    # Build the feature matrix (replace None with 0 for model compatibility)
-    event_ids = list(features_dict.keys())
-    X = []
-    for eid in event_ids:
-        features = [0 if f is None else f for f in features_dict[eid]]
-        X.append(features)
-    X = np.array(X)
+    # Retrieve candidates and score them with a default (invited_flag=0, timestamp=0).
+    event_ids, candidate_sources = generate_candidates(store, user_id, limits)
+    zeros = np.zeros(len(event_ids))
 
     if model is None:
         return jsonify({"status": "fail", "message": "Model not loaded"}), 500
 
-    # Get prediction scores and rank the events.
-    predictions = model.test(X)
-    event_scores = list(zip(event_ids, predictions))
-    event_scores.sort(key=lambda x: -x[1])
-    recommended_events = [eid for eid, score in event_scores]
+    # Compute the candidates' features in batches and rank them.
+    recommended_events, _ = rank_events(store, model, user_id, event_ids, invited=zeros, timestamps=zeros)
 
     return jsonify({
         "status": "success",
         "user_id": user_id,
-        "recommendations": recommended_events
+        "recommendations": recommended_events,
+        "candidate_sources": candidate_sources
     }), 200
 
 # -------------------------------
@@ -0,0 +1,87 @@
+import os
+import json
+import hashlib
+
+# Bump when the layout of any cache artifact changes; every artifact is rebuilt.
+CACHE_SCHEMA_VERSION = 2
+
+def manifest_path(path):
+    return path + '.manifest.json'
+
+def file_hash(path, block=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def fingerprint(path, known=None):
+    # Size, mtime and content hash of a source file. The hash is only recomputed
+    # when size or mtime differ from the known fingerprint.
+    st = os.stat(path)
+    if known and known['size'] == st.st_size and known['mtime_ns'] == st.st_mtime_ns:
+        return dict(known)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': file_hash(path)}
+
+def artifact_digest(sources, upstream):
+    # Identifies an artifact's inputs by content only, so touching a source file
+    # without changing it does not cascade to dependent artifacts.
+    key = json.dumps({'schema': CACHE_SCHEMA_VERSION,
+                      'sources': {p: fp['sha256'] for p, fp in sorted(sources.items())},
+                      'upstream': dict(sorted(upstream.items()))}, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def read_manifest(path):
+    try:
+        with open(manifest_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_manifest(path, manifest):
+    tmp = manifest_path(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, manifest_path(path))
+
+def remove_manifest(path):
+    # Called before an artifact is rewritten, so a rebuild that dies halfway is
+    # never mistaken for a fresh artifact.
+    if os.path.exists(manifest_path(path)):
+        os.remove(manifest_path(path))
+
+def check_manifest(path, sources, upstream):
+    """
+    Returns the artifact's digest if its manifest matches the schema version,
+    the current content of every source file and the digests of the upstream
+    artifacts it was built from; None if it must be rebuilt. A source whose
+    mtime moved but whose content did not is re-stamped in the manifest.
+    """
+    manifest = read_manifest(path)
+    if manifest is None or manifest.get('schema') != CACHE_SCHEMA_VERSION or not os.path.exists(path):
+        return None
+    if sorted(manifest.get('sources', {})) != sorted(sources) or manifest.get('upstream') != upstream:
+        return None
+    current = {}
+    for source in sources:
+        if not os.path.exists(source):
+            return None
+        known = manifest['sources'][source]
+        current[source] = fingerprint(source, known)
+        if current[source]['sha256'] != known['sha256']:
+            return None
+    if current != manifest['sources']:
+        manifest['sources'] = current
+        write_manifest(path, manifest)
+    return manifest['digest']
+
+def source_fingerprints(sources):
+    # Taken before a build, so a source edited mid-build is not recorded as built.
+    return {source: fingerprint(source) for source in sources}
+
+def stamp_manifest(path, fingerprints, upstream):
+    # Records the inputs an artifact was just built from; returns its digest.
+    digest = artifact_digest(fingerprints, upstream)
+    write_manifest(path, {'schema': CACHE_SCHEMA_VERSION, 'sources': fingerprints,
+                          'upstream': upstream, 'digest': digest})
+    return digest
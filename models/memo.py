@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+
+# Every memoized function, by name, so stats and invalidation can reach all of them.
+_memos = {}
+
+class LRUMemo:
+    """
+    Bounded memo for one function with LRU eviction.
+
+    user_arg names the positional argument holding a user id, so entries can be
+    dropped per user when attendance changes. Values are computed outside the
+    lock; one whose user was invalidated (or the memo cleared) meanwhile is
+    returned but not stored. hits, misses, evictions and invalidations are
+    counted.
+    """
+    def __init__(self, function, maxsize, user_arg=None):
+        self.function = function
+        self.maxsize = maxsize
+        self.user_arg = user_arg
+        self.memo = OrderedDict()
+        self.by_user = {}
+        # Bumped by every invalidation of a user, and by clear for everyone.
+        self.generations = {}
+        self.cleared = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+        self.__name__ = function.__name__
+        self.__doc__ = function.__doc__
+
+    def _generation(self, key):
+        return self.cleared, self.generations.get(key[self.user_arg]) if self.user_arg is not None else None
+
+    def __call__(self, *args):
+        with self.lock:
+            if args in self.memo:
+                self.memo.move_to_end(args)
+                self.hits += 1
+                return self.memo[args]
+            self.misses += 1
+            generation = self._generation(args)
+        rv = self.function(*args)
+        with self.lock:
+            if self._generation(args) == generation:
+                self._store(args, rv)
+        return rv
+
+    def _store(self, key, rv):
+        if key not in self.memo and self.user_arg is not None:
+            self.by_user.setdefault(key[self.user_arg], set()).add(key)
+        self.memo[key] = rv
+        self.memo.move_to_end(key)
+        while len(self.memo) > self.maxsize:
+            old, _ = self.memo.popitem(last=False)
+            self._unindex(old)
+            self.evictions += 1
+
+    def _unindex(self, key):
+        if self.user_arg is None:
+            return
+        keys = self.by_user.get(key[self.user_arg])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_user[key[self.user_arg]]
+
+    def _drop(self, keys):
+        for key in list(keys):
+            if key in self.memo:
+                del self.memo[key]
+                self.invalidations += 1
+            self._unindex(key)
+
+    def invalidate_user(self, uid):
+        with self.lock:
+            self.generations[uid] = self.generations.get(uid, 0) + 1
+            self._drop(self.by_user.get(uid, ()))
+
+    def clear(self):
+        with self.lock:
+            self.cleared += 1
+            self.generations.clear()
+            self.memo.clear()
+            self.by_user.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.memo),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+def memoize(maxsize=100000, user_arg=None):
+    def decorator(function):
+        memo = LRUMemo(function, maxsize, user_arg)
+        _memos[function.__name__] = memo
+        return memo
+    return decorator
+
+def invalidate_user(uid):
+    for memo in _memos.values():
+        memo.invalidate_user(uid)
+
+def cache_stats():
+    return {name: memo.stats() for name, memo in _memos.items()}
+
+def clear():
+    for memo in _memos.values():
+        memo.clear()
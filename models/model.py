@@ -1,10 +1,51 @@
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
 import numpy as np
-        
+from models.forest import CompiledForest, CompiledLogistic
+from models.column_cache import save_columns, load_columns
+
+# Blend of the forest and LR probabilities in the final score.
+FOREST_WEIGHT = 0.69
+LR_WEIGHT = 0.57
+# Value of missing (NaN) features in the LR inputs; the forest routes NaN itself.
+LR_FILL_VALUE = 0.0
+# Layout of saved model artifacts; bump when the files Model.save writes change.
+MODEL_ARTIFACT_VERSION = 1
+
 class Model:
     def __init__(self, compress=None, has_none=None, C=0.03, n_est=300):
         print(C)
+        self.C = C
+        self.n_est = n_est
+        # The fitted sklearn estimators, set by fit; None for a model loaded from an artifact.
+        self.models = None
+        self.compress = compress
+        self.has_none = has_none
+        self.fill_value = LR_FILL_VALUE
+        self.weights = (FOREST_WEIGHT, LR_WEIGHT)
+        self.compiled = None
+
+    def __getstate__(self):
+        # Pickles carry the sklearn estimators; the compiled copy is rebuilt on first use.
+        state = dict(self.__dict__)
+        if state.get('models') is not None:
+            state['compiled'] = None
+        return state
+
+    def inputs(self, X):
+        """
+        Imputation stage: the forest and LR inputs of a feature matrix with NaN
+        for missing values. compress selects the forest columns, which keep NaN;
+        has_none selects the LR columns, where NaN becomes fill_value.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        X_rf = X.compress(self.compress, axis=1) if self.compress else X
+        X_lr = X.compress(self.has_none, axis=1) if self.has_none else X.copy()
+        X_lr[np.isnan(X_lr)] = getattr(self, 'fill_value', LR_FILL_VALUE)
+        return X_rf, X_lr
+
+    def fit(self, X, Y):
+        # sklearn is only imported to train; scoring runs on the compiled arrays.
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.linear_model import LogisticRegression
         self.models = [
             #GradientBoostingClassifier(),
             #GradientBoostingClassifier(subsample=0.7),
@@ -18,34 +59,102 @@ class Model:
             #RandomForestClassifier(n_estimators=50, criterion='entropy'),
             #RandomForestClassifier(n_estimators=20, criterion='entropy'),
             #RandomForestClassifier(n_estimators=80, criterion='entropy'),
-            RandomForestClassifier(n_estimators=n_est),
-            LogisticRegression(C=C, penalty='l1', solver='liblinear')
+            RandomForestClassifier(n_estimators=self.n_est),
+            LogisticRegression(C=self.C, penalty='l1', solver='liblinear')
         ]
-        self.compress = compress
-        self.has_none = has_none
-    
-    def fit(self, X, Y):
-        X2 = np.array(X)
-        if self.compress:
-            X3 = X2.compress(self.compress, axis=1)
-        self.models[0].fit(X3, Y)
-        if self.has_none:
-            X3 = X2.compress(self.has_none, axis=1)
-        self.models[1].fit(X3, Y)
-        
+        X_rf, X_lr = self.inputs(X)
+        self.models[0].fit(X_rf, Y)
+        self.models[1].fit(X_lr, Y)
+        self.compiled = None
+
+    def compile(self):
+        # Flat-array copies of the fitted forest and LR, used by test.
+        self.compiled = (CompiledForest.from_sklearn(self.models[0]), CompiledLogistic.from_sklearn(self.models[1]))
+        return self
+
+    def compiled_models(self):
+        # Compiled on first use, which also covers models pickled before compile existed.
+        if getattr(self, 'compiled', None) is None:
+            self.compile()
+        return self.compiled
+
     def test(self, X):
-        X2 = np.array(X)
-        if self.compress:
-            X3 = X2.compress(self.compress, axis=1)
+        forest, lr = self.compiled_models()
+        forest_weight, lr_weight = getattr(self, 'weights', (FOREST_WEIGHT, LR_WEIGHT))
+        X_rf, X_lr = self.inputs(X)
+        return forest.predict(X_rf) * forest_weight + lr.predict(X_lr) * lr_weight
+
+    # test(X) == test_forest(X) + test_lr(X); the halves let a cascade score in stages.
+    def test_forest(self, X):
+        forest, _ = self.compiled_models()
+        return forest.predict(self.inputs(X)[0]) * getattr(self, 'weights', (FOREST_WEIGHT, LR_WEIGHT))[0]
+
+    def test_lr(self, X):
+        # Only the lr_features columns of X affect it.
+        _, lr = self.compiled_models()
+        return lr.predict(self.inputs(X)[1]) * getattr(self, 'weights', (FOREST_WEIGHT, LR_WEIGHT))[1]
+
+    def lr_features(self):
+        # Feature columns the LR reads with a nonzero (L1) coefficient.
+        _, lr = self.compiled_models()
+        columns = np.flatnonzero(self.has_none) if self.has_none else np.arange(len(lr.coef))
+        return columns[np.asarray(lr.coef) != 0].tolist()
+
+    def save(self, dirname, feature_names, feature_schema):
+        """
+        Writes the compiled model as a directory of .npy arrays plus meta.json
+        (see save_columns): the tree and LR arrays, blend weights, feature masks
+        and the feature layout it was trained on. Model.load maps it back.
+        """
+        if getattr(self, 'compiled', None) is None:
+            self.compile()
+        forest, lr = self.compiled
+        columns = {'forest.' + name: values for name, values in forest.columns.items()}
+        columns['lr.coef'] = lr.coef
+        mask = lambda m: [bool(v) for v in m] if m is not None else None
+        save_columns(dirname, columns, {
+            'artifact_version': MODEL_ARTIFACT_VERSION, 'feature_schema': feature_schema,
+            'feature_names': list(feature_names), 'compress': mask(self.compress), 'has_none': mask(self.has_none),
+            'fill_value': getattr(self, 'fill_value', LR_FILL_VALUE),
+            'weights': list(getattr(self, 'weights', (FOREST_WEIGHT, LR_WEIGHT))),
+            'forest_depth': forest.depth, 'lr_intercept': lr.intercept})
+        print(f"[MODEL SAVE] Model artifact saved to {dirname}")
+
+    @classmethod
+    def load(cls, dirname, feature_names, feature_schema):
+        """
+        Maps a Model.save artifact read-only, so processes loading the same file
+        share its pages. Raises ValueError if the artifact was written in another
+        layout or for other features than feature_names / feature_schema. The
+        loaded model scores with test only; it carries no sklearn estimators.
+        """
+        columns, meta = load_columns(dirname)
+        if meta.get('artifact_version') != MODEL_ARTIFACT_VERSION:
+            raise ValueError(f"Model artifact {dirname} has version {meta.get('artifact_version')}, "
+                             f"expected {MODEL_ARTIFACT_VERSION}")
+        if meta['feature_schema'] != feature_schema or meta['feature_names'] != list(feature_names):
+            raise ValueError(f"Model artifact {dirname} was trained on feature schema {meta['feature_schema']} "
+                             f"({len(meta['feature_names'])} features), expected {feature_schema} "
+                             f"({len(feature_names)} features)")
+        model = cls.__new__(cls)
+        model.models = None
+        model.compress, model.has_none = meta['compress'], meta['has_none']
+        model.fill_value = meta['fill_value']
+        model.weights = tuple(meta['weights'])
+        forest = CompiledForest({name[len('forest.'):]: values for name, values in columns.items()
+                                 if name.startswith('forest.')}, meta['forest_depth'])
+        model.compiled = (forest, CompiledLogistic(columns['lr.coef'], meta['lr_intercept']))
+        return model
+
+    def test_sklearn(self, X):
+        # Reference path through sklearn's predict_proba; test must agree with it.
+        X_rf, X_lr = self.inputs(X)
         '''    
         rez = self.models[0].predict_proba(X2)
         for m in self.models[1:]:
             rez += m.predict_proba(X2)
         '''
-        rez = self.models[0].predict_proba(X3)[:,1] * 0.69
-        
-        if self.has_none:
-            X3 = X2.compress(self.has_none, axis=1)
-        rez += self.models[1].predict_proba(X3)[:,1] * 0.57
-        
+        forest_weight, lr_weight = getattr(self, 'weights', (FOREST_WEIGHT, LR_WEIGHT))
+        rez = self.models[0].predict_proba(X_rf)[:,1] * forest_weight
+        rez += self.models[1].predict_proba(X_lr)[:,1] * lr_weight
         return rez
\ No newline at end of file
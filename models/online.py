@@ -0,0 +1,124 @@
+import os
+import time
+import queue
+import threading
+import numpy as np
+from models.forest import CompiledLogistic, expit
+
+# Set to 0 to serve the offline LR unchanged.
+ONLINE_LEARNING = os.getenv("ONLINE_LEARNING", "1") != "0"
+# Examples per update, and the longest a queued example waits for one.
+ONLINE_BATCH = int(os.getenv("ONLINE_BATCH", 32))
+ONLINE_INTERVAL = float(os.getenv("ONLINE_INTERVAL", 5.0))
+# Base step size and L1 strength of the updates.
+ONLINE_LEARNING_RATE = float(os.getenv("ONLINE_LEARNING_RATE", 0.05))
+ONLINE_L1 = float(os.getenv("ONLINE_L1", 1e-4))
+
+class OnlineLR:
+    """
+    Keeps the LR half of a fitted Model learning from live labelled
+    interactions, starting from its offline coefficients.
+
+    add() queues one feature row and label; a background thread takes them in
+    micro-batches and makes one step on the L1-regularized logistic loss per
+    batch over the model's has_none columns, imputed as Model.inputs does.
+    Steps are per-coordinate (AdaGrad), since the raw features range from
+    shares to counts in the hundreds, and the L1 part is applied by truncation,
+    so coefficients stay sparse. Each step is published by swapping the model's
+    compiled (forest, lr) pair in one assignment: a concurrent Model.test sees
+    either the old or the new coefficients, never a mix.
+    """
+    def __init__(self, model, batch=ONLINE_BATCH, interval=ONLINE_INTERVAL,
+                 learning_rate=ONLINE_LEARNING_RATE, l1=ONLINE_L1):
+        if getattr(model, 'compiled', None) is None:
+            model.compile()
+        lr = model.compiled[1]
+        self.model = model
+        self.batch = batch
+        self.interval = interval
+        self.learning_rate = learning_rate
+        self.l1 = l1
+        self.coef = np.array(lr.coef, dtype=np.float64)
+        self.intercept = float(lr.intercept)
+        self.squared = np.zeros(len(self.coef) + 1)
+        self.updates = 0
+        self.examples = 0
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, x, label):
+        # x is a full feature row with NaN for missing values; label is 1 or 0.
+        self.queue.put((np.asarray(x, dtype=np.float64), float(label)))
+
+    def step(self, X, y):
+        with self._lock:
+            self._step(X, y)
+
+    def _step(self, X, y):
+        X_lr = np.column_stack([self.model.inputs(X)[1], np.ones(len(X))])
+        w = np.append(self.coef, self.intercept)
+        grad = X_lr.T @ (expit(X_lr @ w) - y) / len(y)
+        self.squared += grad * grad
+        rate = self.learning_rate / (np.sqrt(self.squared) + 1e-8)
+        w -= rate * grad
+        # Truncated L1 on the coefficients; the intercept is not penalized.
+        w[:-1] = np.sign(w[:-1]) * np.maximum(np.abs(w[:-1]) - rate[:-1] * self.l1, 0)
+        self.coef, self.intercept = w[:-1], float(w[-1])
+        self.updates += 1
+        self.examples += len(y)
+        self.publish()
+
+    def publish(self):
+        forest, _ = self.model.compiled
+        self.model.compiled = (forest, CompiledLogistic(self.coef.copy(), self.intercept))
+
+    def step_items(self, items):
+        self.step(np.array([x for x, _ in items]), np.array([y for _, y in items]))
+
+    def take(self):
+        # One micro-batch: waits up to interval for a first example, then up to
+        # interval more for the batch to fill.
+        items = []
+        deadline = time.time() + self.interval
+        while len(items) < self.batch:
+            wait = deadline - time.time()
+            if wait <= 0:
+                break
+            try:
+                items.append(self.queue.get(timeout=wait))
+            except queue.Empty:
+                break
+            if len(items) == 1:
+                deadline = time.time() + self.interval
+        return items
+
+    def flush(self):
+        # Runs the updates for everything queued so far in the calling thread.
+        items = []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(items), self.batch):
+            self.step_items(items[start:start + self.batch])
+
+    def run(self):
+        while not self._stop.is_set():
+            items = self.take()
+            if items:
+                self.step_items(items)
+                if self.updates % 100 == 0:
+                    print(f"[ONLINE] {self.updates} updates over {self.examples} interactions")
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="online-lr", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -1,145 +1,95 @@
 import random
-import time
 from math import sqrt
 import numpy as np
 import pandas as pd
-from dateutil.parser import parse
-import simplejson as json
+from models.data_processing import parse_timestamps
 import ast
 from models.model import Model
 import pickle
 import os
-from models.data_processing import process_users, process_events, process_friends, process_attendance, fill_missing_location, process_and_update_ages
-
-# --- Caching Functions ---
-def cache_data(filename, data):
-    with open(filename, 'wb') as f:
-        pickle.dump(data, f)
-    print(f"[CACHE] Data cached to {filename}")  # Prints: Data has been saved to filename
-
-def load_cached_data(filename):
-    if os.path.exists(filename):
-        with open(filename, 'rb') as f:
-            data = pickle.load(f)
-        print(f"[CACHE] Loaded cached data from {filename}")  # Prints: Data loaded from filename
-        return data
-    return None
-
-def get_user_info():
-    filename = 'cache_user_info.pkl'
-    user_info = load_cached_data(filename)
-    if user_info is None:
-        user_info = process_users()
-        cache_data(filename, user_info)
-    return user_info
-
-def get_event_info():
-    filename = 'cache_event_info_sampled.pkl'
-    event_info = load_cached_data(filename)
-    if event_info is None:
-        event_info = process_events()
-        cache_data(filename, event_info)
-    return event_info
-
-def get_friends():
-    filename = 'cache_friends.pkl'
-    friends = load_cached_data(filename)
-    if friends is None:
-        friends = process_friends()
-        cache_data(filename, friends)
-    return friends
-
-def get_attendance():
-    filename_uid = 'cache_attendance_by_uid.pkl'
-    filename_eid = 'cache_attendance_by_eid.pkl'
-    attendance_by_uid = load_cached_data(filename_uid)
-    attendance_by_eid = load_cached_data(filename_eid)
-    if attendance_by_uid is None or attendance_by_eid is None:
-        attendance_by_uid, attendance_by_eid = process_attendance()
-        cache_data(filename_uid, attendance_by_uid)
-        cache_data(filename_eid, attendance_by_eid)
-    return attendance_by_uid, attendance_by_eid
-
-def get_full_data():
-    # Load or compute individual parts
-    user_info = get_user_info()
-    event_info = get_event_info()
-    friends = get_friends()
-    attendance_by_uid, attendance_by_eid = get_attendance()
-    # If none of the users have a location, update missing locations and ages.
-    if not any(user.get('location') for user in user_info.values()):
-        fill_missing_location(user_info, event_info, attendance_by_uid, attendance_by_eid)
-        process_and_update_ages(user_info)
-        cache_data('cache_user_info.pkl', user_info)
-    return user_info, event_info, attendance_by_uid, attendance_by_eid, friends
-
-user_info, event_info, attendance_by_uid, attendance_by_eid, friends = get_full_data()
-print("[INFO] All data loaded successfully.")  # Indicates data processing and caching completed
+import argparse
+import multiprocessing
+from models.memo import memoize, invalidate_user, clear as clear_memos
+from models.spatial import location_points
+from models.candidates import CandidateGenerator
+from models.cascade import CascadeRanker
+from models.coattendance import COATTEND_TYPES
+from models.datastore import DataStore
+
+# Upper bound on entries per memoized helper before LRU eviction kicks in.
+MEMO_MAXSIZE = int(os.getenv("RECOMMENDATION_MEMO_MAXSIZE", 100000))
+# Append the co-attendance index's live updates to its delta file after this many of them.
+COATTENDANCE_SAVE_EVERY = 1000
+# Worker processes for building training / test features; 1 keeps everything in-process.
+WORKERS = int(os.getenv("RECOMMENDATION_WORKERS", 1))
 
 # --- Helper Functions ---
-def memoize(function):
-    memo = {}
-    def wrapper(*args):
-        if args in memo:
-            return memo[args]
-        else:
-            rv = function(*args)
-            memo[args] = rv
-            return rv
-    return wrapper
-
-def get_event_sim_by_users(id1, id2, exclude):
-    attend1 = attendance_by_eid.get(id1, [])
-    attend2 = attendance_by_eid.get(id2, [])
-    set1 = set()
-    set2 = set()
-    for a in attend1:
-        if a.get('yes') or a.get('maybe'):
-            set1.add(a['uid'])
-    for a in attend2:
-        if a.get('yes') or a.get('maybe'):
-            set2.add(a['uid'])
-    intersection = set1.intersection(set2)
-    s = float(len(intersection))
-    if exclude in intersection:
-        s -= 1
-    if min(len(set1), len(set2)) > 0:
-        s /= min(len(set1), len(set2))
+@memoize(maxsize=MEMO_MAXSIZE, user_arg=1)
+def get_user_coattended_events(store, uid):
+    # Events the user said yes or maybe to, in attendance order. Read by candidate
+    # generation and the co-attendance feature of every request; callers must not
+    # modify the returned list.
+    return store.attendance.user_events(uid, COATTEND_TYPES)
+
+# --- Write path ---
+def invalidate_attendance(store, uid, eid):
+    # A new (uid, eid) record only changes uid's own past events.
+    invalidate_user(uid)
+
+def attendee_overlap(store, eid, other):
+    # Overlap of two events' yes/maybe attendee sets once the user being recorded for eid joins it.
+    matrices = store.attendance_matrices
+    return len(np.intersect1d(matrices.attendees(eid), matrices.attendees(other), assume_unique=True)) + 1
+
+def record_attendance(store, record):
+    """
+    Adds a new attendance record ({'uid':..., 'eid':..., 'yes': True, ...}) to the
+    in-memory indexes and drops the memoized results that depend on it.
+    """
+    uid, eid = record['uid'], record['eid']
+    # Indexes built lazily after the dicts are updated would count the record twice.
+    store.build_indexes()
+    with store.writing():
+        if any(record.get(kind) for kind in COATTEND_TYPES):
+            row = store.ids.users.get(uid)
+            if row < 0 or row not in store.attendance_matrices.attendees(eid):
+                store.coattendance_index.add(eid, get_user_coattended_events(store, uid),
+                                             overlap=lambda eid, other: attendee_overlap(store, eid, other))
+                if store.coattendance_path and store.coattendance_index.updates % COATTENDANCE_SAVE_EVERY == 0:
+                    store.coattendance_index.save_delta(store.coattendance_path)
+        store.attendance.add(record)
+        store.attendance_matrices.add(record)
+        store.event_counters.add_record(record)
+        invalidate_attendance(store, uid, eid)
+
+def interaction_example(store, record):
+    """
+    Feature row and label for a live interaction, or None if the record is not
+    an interested/not-interested response or its event is not in event_info.
+    Call it before record_attendance so the row is built as /recommend would
+    have built it, without the record itself.
+    """
+    if record is None:
+        return None
+    if record.get('yes'):
+        label = 1
+    elif record.get('no'):
+        label = 0
     else:
-        s = 0
-    return s
+        return None
+    with store.reading():
+        _, X = process_events_for_user_batch(store, record['uid'], [record['eid']], invited=[0], timestamps=[0])
+    if not len(X):
+        return None
+    return X[0], label
 
-def get_event_sim_by_cluster(user, event):
-    f = []
-    for key in ['user_taste', 'friends_taste', 'user_hates', 'friends_hate', 'user_invited']:
-        if key in user:
-            s = 0
-            taste = user[key]
-            s += taste['cl0'][event['cl0']] * 8
-            s += taste['cl1'][event['cl1']] * 20
-            s += taste['cl2'][event['cl2']] * 40
-            f.append(s)
-        else:
-            f.append(None)
-    return f
-
-@memoize
-def get_user_attendance(uid):
-    return attendance_by_uid.get(uid, [])
-
-def get_event_attendance(eid):
-    return attendance_by_eid.get(eid, [])
-
-@memoize
-def get_event_similarity_by_user_big(uid, eid):
-    yes_sim = []
-    attend_list_u = get_user_attendance(uid)
-    for e2 in attend_list_u:
-        if (e2.get('yes') or e2.get('maybe')) and e2['eid'] != eid:
-            yes_sim.append(get_event_sim_by_users(eid, e2['eid'], uid))
-    if yes_sim:
-        return sum(yes_sim) / len(yes_sim)
-    return None
+def register_event(store, event):
+    # Adds a new event (with 'id', 'location' and 'words') to the recommender's indexes.
+    store.build_indexes()
+    with store.writing():
+        store.event_info[event['id']] = event
+        store.event_words.add(event['id'], event.get('words'))
+        store.spatial_index.add(event['id'], event.get('location'))
 
 def get_location_distance(l1, l2):
     if not l1 or not l2:
@@ -197,146 +147,242 @@ def process_locations(elocs, ulocs):
 
 ATTR = ['yes', 'no', 'maybe', 'invited']
 
+# --- Candidate generation ---
+# Default number of candidates taken from each retrieval source, in union order.
+CANDIDATE_LIMITS = {'geo': 200, 'friends': 200, 'coattendance': 200, 'popularity': 100}
+# Radius of the geo proximity source around the user's location.
+GEO_RADIUS_KM = 200.0
+
+def candidates_by_geo(store, uid, limit):
+    # Events nearest to the user's (first) location, within GEO_RADIUS_KM.
+    points = location_points((store.user_info.get(uid) or {}).get('location'))
+    if points is None:
+        return []
+    return store.spatial_index.within_radius(points[0][0], points[0][1], GEO_RADIUS_KM)[0]
+
+def candidates_by_friends(store, uid, limit):
+    # Events the user's friends said yes or maybe to, most friends first.
+    return store.attendance_matrices.top_events(store.friends.get(uid, []), COATTEND_TYPES)
+
+def candidates_by_coattendance(store, uid, limit):
+    # Co-attendance neighbours of the user's past yes/maybe events.
+    return store.coattendance_index.neighbors_of(get_user_coattended_events(store, uid))
+
+def candidates_by_popularity(store, uid, limit):
+    # Globally most attended events; over-fetched so events missing from
+    # event_info can be skipped.
+    return store.event_counters.top(COATTEND_TYPES, limit * 4)
+
+candidate_generator = CandidateGenerator()
+candidate_generator.register('geo', candidates_by_geo, CANDIDATE_LIMITS['geo'])
+candidate_generator.register('friends', candidates_by_friends, CANDIDATE_LIMITS['friends'])
+candidate_generator.register('coattendance', candidates_by_coattendance, CANDIDATE_LIMITS['coattendance'])
+candidate_generator.register('popularity', candidates_by_popularity, CANDIDATE_LIMITS['popularity'])
+
+def generate_candidates(store, uid, limits=None):
+    """
+    Candidate events for uid from the union of the registered retrieval sources,
+    restricted to events in event_info. limits overrides the per-source counts.
+    Returns (eids, counts) where counts maps each source to the number of
+    candidates it contributed after deduplication.
+    """
+    with store.reading():
+        return candidate_generator.generate(store, uid, limits, accept=lambda eid: eid in store.event_info)
+
 # --- Process events for a given user ---
-def process_events_for_user(uid, e_dict):
-    # e_dict maps event id to a tuple (invited_flag, timestamp)
-    attend_list_u = get_user_attendance(uid)
-    e_list = [event_info[eid] for eid in e_dict.keys() if eid in event_info]
-    user = user_info.get(uid)
-    attend_dict = {record['eid']: record for record in attend_list_u}
-    
-    friend_entry = friends.get(uid, [])
-    friend_ids = set(friend_entry)
-    
-    features_dict = {}
-    for e in e_list:
-        attend_list_e = get_event_attendance(e['id'])
-        features = [0, 0, 0, 0]
-        for att in attend_list_e:
-            if att.get('yes'):
-                features[0] += 1
-            if att.get('no'):
-                features[1] += 1
-            if att.get('maybe'):
-                features[2] += 1
-            if att.get('invited'):
-                features[3] += 1
-        features.extend([
-            features[1] * 1.0 / (features[0] + 1),
-            features[2] * 1.0 / (features[0] + 1),
-            features[3] * 1.0 / (features[0] + 1),
-        ])
-        
-        features2 = [0, 0, 0, 0]
-        for att in attend_list_e:
-            if att['uid'] not in friend_ids:
+def process_events_for_user(store, uid, e_dict):
+    """
+    Features of the events in e_dict, which maps event id to a tuple
+    (invited_flag, timestamp). Returns {eid: row} with one float32 row of
+    FEATURE_COUNT columns per event found in event_info, NaN where a feature is
+    missing.
+    """
+    eids = list(e_dict)
+    eids, X = process_events_for_user_batch(store, uid, eids, invited=[e_dict[eid][0] for eid in eids],
+                                            timestamps=[e_dict[eid][1] for eid in eids])
+    return dict(zip(eids, X))
+
+# --- Batch feature engine ---
+# Columns of a feature row. Bump FEATURE_SCHEMA_VERSION when a column changes
+# meaning without being renamed, so saved models trained on the old layout are rejected.
+FEATURE_NAMES = (
+    ['yes', 'no', 'maybe', 'invited', 'no_per_yes', 'maybe_per_yes', 'invited_per_yes'] +
+    ['friends_yes', 'friends_no', 'friends_maybe', 'friends_invited',
+     'friends_no_per_yes', 'friends_maybe_per_yes', 'friends_invited_per_yes'] +
+    ['friends_yes_share', 'friends_no_share', 'friends_maybe_share', 'friends_invited_share'] +
+    ['location_match', 'age_difference', 'gender_share', 'coattendance_similarity'] +
+    ['user_taste', 'friends_taste', 'user_hates', 'friends_hate', 'user_invited'] +
+    ['start_delta', 'creator_is_friend'] +
+    ['prototype_similarity', 'prototype_minus_invite', 'hate_minus_invite', 'hate_minus_prototype'] +
+    ['invited_flag', 'location_distance'])
+FEATURE_SCHEMA_VERSION = 1
+FEATURE_COUNT = len(FEATURE_NAMES)
+
+def process_events_for_user_batch(store, uid, eids, invited=None, timestamps=None, columns=None):
+    """
+    Features of many candidate events for one user.
+
+    eids is an array of candidate event ids; invited and timestamps are optional
+    arrays aligned with it (the two halves of the e_dict tuples). Events missing
+    from event_info are dropped. columns optionally lists the feature columns
+    to compute; the groups of features that fill none of them are skipped, so
+    the other columns may stay NaN.
+
+    Returns (eids, X) where X is a float32 matrix with one row per kept event
+    and NaN for missing features.
+    """
+    keep = [i for i, eid in enumerate(eids) if eid in store.event_info]
+    eids = [eids[i] for i in keep]
+    n = len(eids)
+    X = np.full((n, FEATURE_COUNT), np.nan)
+    if n == 0:
+        return eids, X.astype(np.float32)
+    events = [store.event_info[eid] for eid in eids]
+    user = store.user_info.get(uid) or {}
+    friend_ids = set(store.friends.get(uid, []))
+    wanted = np.ones(FEATURE_COUNT, dtype=bool)
+    if columns is not None:
+        wanted[:] = False
+        wanted[list(columns)] = True
+    need = lambda start, stop=None: wanted[start:stop or start + 1].any()
+
+    # Response counts over all attendees (0-6) from the per-event counters and
+    # over friends only (7-17) as column sums of the sparse attendance matrices.
+    if need(0, 7):
+        counts = store.event_counters.get(eids, ATTR)
+        X[:, 0:4] = counts
+        X[:, 4:7] = counts[:, 1:4] / (counts[:, :1] + 1)
+    if need(7, 18):
+        friend_counts = store.attendance_matrices.friend_counts(friend_ids, eids, ATTR)
+        X[:, 7:11] = friend_counts
+        X[:, 11:14] = friend_counts[:, 1:4] / (friend_counts[:, :1] + 1)
+        X[:, 14:18] = friend_counts / (len(friend_ids) + 1.0)
+
+    if need(18):
+        X[:, 18] = [process_locations(e.get('newloc2', []), user.get('newloc2', []))[0] for e in events]
+
+    # Age profile difference; the jitter is drawn in event order, as in the loop version.
+    birth = user.get('birth')
+    if birth and isinstance(birth, (str, int)) and need(19):
+        for i, e in enumerate(events):
+            if 'ages' not in e:
                 continue
-            if att.get('yes'):
-                features2[0] += 1
-            if att.get('no'):
-                features2[1] += 1
-            if att.get('maybe'):
-                features2[2] += 1
-            if att.get('invited'):
-                features2[3] += 1
-        features2.extend([
-            features2[1] * 1.0 / (features2[0] + 1),
-            features2[2] * 1.0 / (features2[0] + 1),
-            features2[3] * 1.0 / (features2[0] + 1),
-        ])
-        features2.extend([
-            features2[0] / (len(friend_ids) + 1.0),
-            features2[1] / (len(friend_ids) + 1.0),
-            features2[2] / (len(friend_ids) + 1.0),
-            features2[3] / (len(friend_ids) + 1.0),
-        ])
-        features.extend(features2)
-        
-        # Add location difference features (if newloc2 is available)
-        features.extend(
-            process_locations(
-                e.get('newloc2', []),
-                user.get('newloc2', [])
-            )
-        )
-        
-        # Add age profile difference if available
-        if user.get('birth') and isinstance(user.get('birth'), (str, int)) and 'ages' in e:
             try:
-                d = abs(2013 - int(user['birth']) - e['ages']['mean'])
+                d = abs(2013 - int(birth) - e['ages']['mean'])
             except:
-                d = None
-            features.append(d + int(random.random() * 6) if d is not None else None)
-        else:
-            features.append(None)
-        
-        # Add gender profile
-        if user.get('gender') and isinstance(user.get('gender'), str) and 'genders' in e:
-            features.append((e['genders'][user['gender']] + 1.0) / (e['genders'].get('male', 0) + e['genders'].get('female', 0) + 2.0))
-        else:
-            features.append(None)
-        
-        # Add event similarity by user attendance
-        features.append(get_event_similarity_by_user_big(uid, e['id']))
-        
-        # Add event similarity by clusters
-        features.extend(get_event_sim_by_cluster(user, e))
-        
-        # Add time difference: (event start time - train timestamp)
-        if 'start' in e and e_dict.get(e['id']):
-            features.append(e['start'] - e_dict[e['id']][1])
-        else:
-            features.append(None)
-        
-        # Add flag if event creator is a friend
-        features.append(e.get('creator') in friend_ids)
-        
-        # Add prototype (word model) similarity features if available
-        if 'prototype' in user:
-            features.append(get_event_distance(user['prototype'], e['words']))
-        else:
-            features.append(None)
-        
-        if 'prototype' in user and 'prototype_invite' in user:
-            v1 = get_event_distance(user['prototype'], e['words'])
-            v2 = get_event_distance(user['prototype_invite'], e['words'])
-            if v1 is not None and v2 is not None:
-                features.append(v1 - v2)
-            else:
-                features.append(None)
-        else:
-            features.append(None)
-        if 'prototype_hate' in user and 'prototype_invite' in user:
-            v1 = get_event_distance(user['prototype_hate'], e['words'])
-            v2 = get_event_distance(user['prototype_invite'], e['words'])
-            if v1 is not None and v2 is not None:
-                features.append(v1 - v2)
-            else:
-                features.append(None)
-        else:
-            features.append(None)
-        if 'prototype_hate' in user and 'prototype' in user:
-            v1 = get_event_distance(user['prototype_hate'], e['words'])
-            v2 = get_event_distance(user['prototype'], e['words'])
-            if v1 is not None and v2 is not None:
-                features.append(v1 - v2)
-            else:
-                features.append(None)
-        else:
-            features.append(None)
-        
-        # Add the invited flag from the training data (if present)
-        if e_dict.get(e['id']):
-            features.append(e_dict[e['id']][0])
-        else:
-            features.append(None)
-        
-        # Add old location distance (event vs. user)
-        features.append(get_location_distance(e.get('location'), user.get('location')))
-            
-        features_dict[e['id']] = features
-        
-    return features_dict
+                continue
+            X[i, 19] = d + int(random.random() * 6)
+
+    gender = user.get('gender')
+    if gender and isinstance(gender, str) and need(20):
+        for i, e in enumerate(events):
+            if 'genders' in e:
+                g = e['genders']
+                X[i, 20] = (g[gender] + 1.0) / (g.get('male', 0) + g.get('female', 0) + 2.0)
+
+    if need(21):
+        X[:, 21] = store.coattendance_index.user_similarity(eids, get_user_coattended_events(store, uid))
+
+    for col, key in enumerate(['user_taste', 'friends_taste', 'user_hates', 'friends_hate', 'user_invited'], 22):
+        if key in user and need(col):
+            taste = user[key]
+            X[:, col] = [taste['cl0'][e['cl0']] * 8 + taste['cl1'][e['cl1']] * 20 + taste['cl2'][e['cl2']] * 40
+                         for e in events]
+
+    if timestamps is not None and need(27):
+        start = np.array([e.get('start', np.nan) for e in events], dtype=np.float64)
+        X[:, 27] = start - np.asarray(timestamps, dtype=np.float64)[keep]
+
+    if need(28):
+        X[:, 28] = [e.get('creator') in friend_ids for e in events]
+
+    # Prototype similarities for all candidates come from one product of the
+    # normalized event word matrix with the user's normalized prototypes, and
+    # are then differenced; NaN propagation reproduces the "None if either side
+    # is None" rule.
+    keys = [key for key in ['prototype', 'prototype_invite', 'prototype_hate'] if key in user and need(29, 33)]
+    S = store.event_words.similarities(eids, [user[key] for key in keys]) if keys else None
+    sims = {key: S[:, j].astype(np.float64) for j, key in enumerate(keys)}
+    if 'prototype' in sims:
+        X[:, 29] = sims['prototype']
+    if 'prototype' in sims and 'prototype_invite' in sims:
+        X[:, 30] = sims['prototype'] - sims['prototype_invite']
+    if 'prototype_hate' in sims and 'prototype_invite' in sims:
+        X[:, 31] = sims['prototype_hate'] - sims['prototype_invite']
+    if 'prototype_hate' in sims and 'prototype' in sims:
+        X[:, 32] = sims['prototype_hate'] - sims['prototype']
+
+    if invited is not None and need(33):
+        X[:, 33] = np.asarray(invited, dtype=np.float64)[keep]
+
+    # Old location distance: single-point event locations come vectorized from the
+    # spatial index, multi-point ones go through the scalar path.
+    uloc = user.get('location')
+    if uloc and need(34):
+        X[:, 34] = store.spatial_index.distances(eids, uloc)
+        for i, e in enumerate(events):
+            l = e.get('location')
+            if l and not isinstance(l[0], float):
+                X[i, 34] = get_location_distance(l, uloc)
+
+    return eids, X.astype(np.float32)
+
+# --- Cascade ranking ---
+# Candidates that get the full features and forest after the LR pre-score; 0 scores all in full.
+CASCADE_HEAD = int(os.getenv("CASCADE_HEAD", 100))
+# Length of the top of the ranking compared against full scoring, and the
+# share of requests scored both ways to measure that.
+CASCADE_TOP_K = int(os.getenv("CASCADE_TOP_K", 20))
+CASCADE_AUDIT_RATE = float(os.getenv("CASCADE_AUDIT_RATE", 0.02))
+
+cascade_ranker = CascadeRanker(CASCADE_HEAD, CASCADE_TOP_K, CASCADE_AUDIT_RATE)
+
+def rank_events(store, model, uid, eids, invited=None, timestamps=None, ranker=None):
+    """
+    Candidate events for uid ranked by model through the cascade ranker (see
+    CascadeRanker). invited and timestamps are aligned with eids, as for
+    process_events_for_user_batch. Returns (eids, scores), best first. Every
+    stage reads the indexes under one store.reading(), so no write lands between them.
+    """
+    position = {eid: i for i, eid in enumerate(eids)}
+    def features(subset, columns):
+        rows = [position[eid] for eid in subset]
+        return process_events_for_user_batch(
+            store, uid, subset, columns=columns,
+            invited=None if invited is None else np.asarray(invited)[rows],
+            timestamps=None if timestamps is None else np.asarray(timestamps)[rows])
+    with store.reading():
+        return (ranker or cascade_ranker).rank(model, features, list(eids))
+
+def cascade_stats():
+    return cascade_ranker.stats()
+
+def report_cascade(store, model, heads, users=200):
+    # Top-k divergence from full scoring and latency of each head, over the
+    # candidates of the first users in user_info.
+    uids = list(store.user_info)[:users]
+    for head in heads:
+        clear_memos()
+        ranker = CascadeRanker(head, CASCADE_TOP_K, 1.0)
+        for uid in uids:
+            eids, _ = generate_candidates(store, uid)
+            zeros = np.zeros(len(eids))
+            rank_events(store, model, uid, eids, invited=zeros, timestamps=zeros, ranker=ranker)
+        stats = ranker.stats()
+        print(f"[CASCADE] head={head} top-{stats['k']} differs for {stats['topk_differs']}/{stats['audited']} users, "
+              f"mean overlap {stats['mean_topk_overlap']:.3f}, {stats['mean_cascade_ms']:.1f} ms "
+              f"vs {stats['mean_full_ms']:.1f} ms in full")
+
+# --- Model artifacts ---
+# Compiled model written by run_full, loaded by the servers.
+MODEL_ARTIFACT = "rf_model_25.model"
+
+def save_model_artifact(model, dirname):
+    model.save(dirname, FEATURE_NAMES, FEATURE_SCHEMA_VERSION)
+
+def load_model_artifact(dirname):
+    # Fails if the model was trained on another feature layout than the one built here.
+    return Model.load(dirname, FEATURE_NAMES, FEATURE_SCHEMA_VERSION)
 
 def write_submission(submission_name, user_events_dict):
     users = sorted(user_events_dict)
@@ -345,26 +391,68 @@ def write_submission(submission_name, user_events_dict):
     submission[["User", "Events"]].to_csv(submission_name, index=False)
     print(f"[SUBMISSION] Saved submission to {submission_name}")  # Informs that the submission CSV is saved
 
+# --- Parallel feature construction ---
+# Store of the forked feature workers, set by the pool initializer.
+worker_store = None
+
+def init_worker(store):
+    global worker_store
+    worker_store = store
+
+def user_features(task, store=None):
+    # The age jitter is seeded per user, so features do not depend on which
+    # worker builds them or in which order.
+    uid, e_dict = task
+    random.seed(str(uid))
+    return process_events_for_user(store or worker_store, uid, e_dict)
+
+def build_user_features(store, tasks, workers=None, label="FEATURES"):
+    """
+    Runs user_features over a list of (uid, e_dict) tasks and returns the
+    feature dicts in task order. With workers > 1 the users are spread over a
+    forked process pool: the store's indexes are built before forking, so workers
+    inherit them copy-on-write, and only the tasks and their features are pickled.
+    """
+    workers = WORKERS if workers is None else workers
+    step = max(len(tasks) // 10, 1)
+    results = []
+    if workers > 1 and len(tasks) > 1:
+        chunksize = max(1, min(64, len(tasks) // (workers * 8)))
+        store.build_indexes()
+        # Fork initargs reach the workers by inheritance, not pickling.
+        with multiprocessing.get_context("fork").Pool(workers, init_worker, (store,)) as pool:
+            for features_dict in pool.imap(user_features, tasks, chunksize):
+                results.append(features_dict)
+                if len(results) % step == 0:
+                    print(f"[{label}] Processed {len(results)}/{len(tasks)} users with {workers} workers")
+    else:
+        for task in tasks:
+            results.append(user_features(task, store))
+            if len(results) % step == 0:
+                print(f"[{label}] Processed {len(results)}/{len(tasks)} users")
+    return results
+
 # --- Data splitting and evaluation functions ---
 
-def get_crossval_data():
-    train = pd.read_csv("models/data/train.csv")
+def get_crossval_data(store, workers=None):
+    train = pd.read_csv("models/data/train.csv", dtype={'timestamp': object})
+    train['timestamp'] = parse_timestamps(train['timestamp'])
     train_dict = {}
     duplicates = set()
-    for _, row in train.iterrows():
-        uid = row['user']
-        key = (uid, row['event'])
+    for uid, eid, invited, interested, not_interested, timestamp in zip(
+            *(train[c].tolist() for c in ['user', 'event', 'invited', 'interested', 'not_interested', 'timestamp'])):
+        key = (uid, eid)
         if key in duplicates:
             continue
         duplicates.add(key)
         if uid not in train_dict:
             train_dict[uid] = []
         train_dict[uid].append({
-            'eid': row['event'],
-            'invited': row['invited'],
-            'interested': row['interested'],
-            'not_interested': row['not_interested'],
-            'timestamp': time.mktime(parse(row['timestamp']).timetuple())
+            'eid': eid,
+            'invited': invited,
+            'interested': interested,
+            'not_interested': not_interested,
+            'timestamp': timestamp
         })
     splits = []
     keys_list = list(train_dict.keys())
@@ -376,15 +464,11 @@ def get_crossval_data():
         Y2 = []
         results = {}
         keys_out = []
-        count = train['user'].count()
-        for uid in keys_list[split_indices[i]:split_indices[i + 1]]:
+        split_users = keys_list[split_indices[i]:split_indices[i + 1]]
+        tasks = [(uid, {e['eid']: (e['invited'], e['timestamp']) for e in train_dict[uid]}) for uid in split_users]
+        features = build_user_features(store, tasks, workers, label=f"CROSSVAL split {i+1}")
+        for uid, features_dict in zip(split_users, features):
             events = train_dict[uid]
-            e_dict = {e['eid']: (e['invited'], e['timestamp']) for e in events}
-            features_dict = process_events_for_user(uid, e_dict)
-            # Print progress: percent of X built for this split
-            if random.random() < 0.1:
-                progress = len(X) * 100.0 / count
-                print(f"[CROSSVAL] Processed features: {progress:.2f}% complete for split {i+1}")
             results[uid] = []
             for e in events:
                 eid = e['eid']
@@ -399,33 +483,30 @@ def get_crossval_data():
         splits.append((X, Y1, Y2, results, keys_out))
     return splits
 
-def get_test_data():
+def get_test_data(store, workers=None):
     solutions_df = pd.read_csv("models/data/public_leaderboard_solution.csv")
     solutions_dict = {}
     for _, row in solutions_df.iterrows():
         uid = int(row['User'])
         eid = int(row['Events'])
         solutions_dict[uid] = [eid]
-    test = pd.read_csv("models/data/test.csv")
+    test = pd.read_csv("models/data/test.csv", dtype={'timestamp': object})
+    test['timestamp'] = parse_timestamps(test['timestamp'])
     test_dict = {}
-    for _, row in test.iterrows():
-        uid = row['user']
+    for uid, eid, invited, timestamp in zip(*(test[c].tolist() for c in ['user', 'event', 'invited', 'timestamp'])):
         if uid not in solutions_dict:
             continue
         if uid not in test_dict:
             test_dict[uid] = []
         test_dict[uid].append({
-            'eid': row['event'],
-            'invited': row['invited'],
-            'timestamp': time.mktime(parse(row['timestamp']).timetuple())
+            'eid': eid,
+            'invited': invited,
+            'timestamp': timestamp
         })
-    count = len(test_dict)
     test_data = {}
-    for uid, events in test_dict.items():
-        e_dict = {e['eid']: (e['invited'], e['timestamp']) for e in events}
-        count -= 1
-        print(f"[TEST DATA] Processing test data for user {uid}; remaining users: {count}")
-        features_dict = process_events_for_user(uid, e_dict)
+    tasks = [(uid, {e['eid']: (e['invited'], e['timestamp']) for e in events}) for uid, events in test_dict.items()]
+    features = build_user_features(store, tasks, workers, label="TEST DATA")
+    for (uid, events), features_dict in zip(test_dict.items(), features):
         X = []
         for e in events:
             eid = e['eid']
@@ -478,8 +559,8 @@ def run_model(m1, m2, test_data, is_final=True):
         print(f"[RUN MODEL] User {uid}: Final sorted event IDs: {results[uid]}")  # Print final recommendations per user
     return results
 
-def run_crossval():
-    splits = get_crossval_data()
+def run_crossval(store):
+    splits = get_crossval_data(store)
     results_list = []
     for i in range(2):
         s = splits[i]
@@ -528,12 +609,12 @@ def evaluate_test_results(my_results):
     print(f"[EVALUATE] Average test score: {average_score:.4f}")
     return average_score
 
-def run_full():
-    splits = get_crossval_data()
+def run_full(store, workers=None):
+    splits = get_crossval_data(store, workers)
     X = splits[0][0] + splits[1][0]
     Y1 = splits[0][1] + splits[1][1]
     Y2 = splits[0][2] + splits[1][2]
-    test_data = get_test_data()
+    test_data = get_test_data(store, workers)
     remove_features_rfc = [19, 20, 34]
     remove_features_lr = [19, 20, 21, 22, 23, 24, 25, 26, 29, 30, 31, 32, 34]
     not_useful_rfc = [8, 11, 22, 24, 28, 33, 30, 31, 32]
@@ -554,6 +635,7 @@ def run_full():
     with open(model_filename, "wb") as f:
         pickle.dump(m1, f)
     print(f"[MODEL SAVE] Model saved to {model_filename}")
+    save_model_artifact(m1, MODEL_ARTIFACT)
     
     final = False
     results = run_model(m1, None, test_data, is_final=final)
@@ -565,4 +647,13 @@ def run_full():
 from models.eval import apk
 
 if __name__ == "__main__":
-    run_full()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="processes used to build training and test features")
+    parser.add_argument("--cascade-report", type=lambda v: [int(h) for h in v.split(",")], metavar="HEADS",
+                        help="instead of training, compare cascade heads (e.g. 25,50,100) for the saved model")
+    args = parser.parse_args()
+    if args.cascade_report:
+        report_cascade(DataStore.from_csv(), load_model_artifact(MODEL_ARTIFACT), args.cascade_report)
+    else:
+        run_full(DataStore.from_csv(), args.workers)
@@ -0,0 +1,116 @@
+import numpy as np
+from models.ids import IdIndex, grow
+from models.column_cache import field_values
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180.0
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = (np.radians(x) for x in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def location_points(location):
+    # A location is either one [lat, lng] pair or a list of pairs, as in get_location_distance.
+    if not location:
+        return None
+    if isinstance(location[0], float):
+        location = [location]
+    return np.array(location, dtype=np.float64).reshape(-1, 2)
+
+class SpatialIndex:
+    """
+    Uniform lat/lng grid over event locations. Coordinates live in NaN-padded
+    arrays indexed by dense event position and every occupied cell keeps the
+    rows inside it, so a radius query only touches the cells around the user.
+    Events whose location is a list of points are not indexed.
+    """
+    def __init__(self, events=None, cell_deg=1.0):
+        self.events = events if events is not None else IdIndex()
+        self.cell_deg = cell_deg
+        self.lat = np.full(len(self.events), np.nan)
+        self.lng = np.full(len(self.events), np.nan)
+        self.cells = {}
+
+    def _cell(self, lat, lng):
+        return (int(np.floor(lat / self.cell_deg)), int(np.floor(lng / self.cell_deg)))
+
+    def add(self, eid, location):
+        # Inserts or moves one event; safe to call again when an event is re-registered.
+        row = self.events.add(eid)
+        self.lat = grow(self.lat, row + 1, np.nan)
+        self.lng = grow(self.lng, row + 1, np.nan)
+        if not np.isnan(self.lat[row]):
+            self.cells[self._cell(self.lat[row], self.lng[row])].remove(row)
+            self.lat[row] = self.lng[row] = np.nan
+        if location and isinstance(location[0], float):
+            self.lat[row], self.lng[row] = location[0], location[1]
+            self.cells.setdefault(self._cell(location[0], location[1]), []).append(row)
+
+    def distances(self, eids, location):
+        """
+        get_location_distance for many events at once: the minimum planar distance
+        in degrees between each event's point and the given location's point(s).
+        NaN for events without an indexed point.
+        """
+        rows = self.events.lookup(list(eids))
+        out = np.full(len(rows), np.nan)
+        points = location_points(location)
+        known = (rows >= 0) & (rows < len(self.lat))
+        if points is None or not known.any():
+            return out
+        E = np.stack([self.lat[rows[known]], self.lng[rows[known]]], axis=1)
+        out[known] = np.sqrt(((E[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)).min(axis=1)
+        return out
+
+    def within_radius(self, lat, lng, km):
+        """
+        Events within km kilometres (great-circle) of (lat, lng), nearest first.
+        Returns (eids, distances_km).
+        """
+        dlat = km / KM_PER_DEGREE
+        i0, i1 = int(np.floor((lat - dlat) / self.cell_deg)), int(np.floor((lat + dlat) / self.cell_deg))
+        coslat = np.cos(np.radians(min(abs(lat) + dlat, 90.0)))
+        dlng = km / (KM_PER_DEGREE * coslat) if coslat > 1e-9 else 360.0
+        if dlng >= 180.0 or lng - dlng < -180.0 or lng + dlng >= 180.0:
+            # Polar caps and antimeridian crossings: filter occupied cells by latitude only.
+            keys = [key for key in self.cells if i0 <= key[0] <= i1]
+        else:
+            j0, j1 = int(np.floor((lng - dlng) / self.cell_deg)), int(np.floor((lng + dlng) / self.cell_deg))
+            n_cells = (i1 - i0 + 1) * (j1 - j0 + 1)
+            if n_cells > len(self.cells):
+                keys = [key for key in self.cells if i0 <= key[0] <= i1 and j0 <= key[1] <= j1]
+            else:
+                keys = [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1) if (i, j) in self.cells]
+        rows = np.array([row for key in keys for row in self.cells[key]], dtype=np.int64)
+        if not len(rows):
+            return [], np.zeros(0)
+        d = haversine_km(lat, lng, self.lat[rows], self.lng[rows])
+        order = np.argsort(d[d <= km], kind='stable')
+        rows, d = rows[d <= km][order], d[d <= km][order]
+        return [self.events.external(r) for r in rows], d
+
+def build_spatial_index(event_info, events=None, cell_deg=1.0):
+    # Coordinates and cell keys are computed as arrays; cells come from one lexsort.
+    index = SpatialIndex(events, cell_deg)
+    for eid in event_info:
+        index.events.add(eid)
+    index.lat = np.full(len(index.events), np.nan)
+    index.lng = np.full(len(index.events), np.nan)
+    rows = index.events.lookup(list(event_info))
+    locations = field_values(event_info, 'location')
+    single = [i for i, l in enumerate(locations) if l and isinstance(l[0], float)]
+    if not single:
+        return index
+    points = np.array([locations[i][:2] for i in single], dtype=np.float64)
+    rows = rows[single]
+    index.lat[rows], index.lng[rows] = points[:, 0], points[:, 1]
+    ci = np.floor(points[:, 0] / cell_deg).astype(np.int64)
+    cj = np.floor(points[:, 1] / cell_deg).astype(np.int64)
+    order = np.lexsort((cj, ci))
+    ci, cj, rows = ci[order], cj[order], rows[order]
+    bounds = np.flatnonzero((np.diff(ci) != 0) | (np.diff(cj) != 0)) + 1
+    starts = np.concatenate([[0], bounds])
+    for start, group in zip(starts, np.split(rows, bounds)):
+        index.cells[(int(ci[start]), int(cj[start]))] = group.tolist()
+    return index
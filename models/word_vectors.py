@@ -0,0 +1,82 @@
+import numpy as np
+from models.ids import IdIndex, grow
+from models.column_cache import field_values
+
+def normalize_words(words, width=None):
+    """
+    log(w + 1)-scales and L2-normalizes one word-count vector. Returns None when
+    the vector is empty, not numeric, of the wrong width or all zeros, which is
+    where get_event_distance returns None.
+    """
+    if words is None or len(words) == 0:
+        return None
+    try:
+        v = np.log(np.asarray(words, dtype=np.float64) + 1)
+    except (TypeError, ValueError):
+        return None
+    if v.ndim != 1 or (width is not None and len(v) != width):
+        return None
+    norm = np.sqrt(np.sum(v * v))
+    if norm == 0:
+        return None
+    return v / norm
+
+class EventWordMatrix:
+    """
+    Event word vectors stored once as a float32 matrix of log-scaled, L2-normalized
+    rows, so cosine similarity against a user prototype is a dot product. Rows of
+    events without a usable vector are all-NaN.
+    """
+    def __init__(self, events, matrix):
+        self.events = events
+        self.matrix = matrix
+
+    @property
+    def width(self):
+        return self.matrix.shape[1]
+
+    def add(self, eid, words):
+        row = self.events.add(eid)
+        self.matrix = grow(self.matrix, row + 1, np.nan)
+        v = normalize_words(words, self.width)
+        self.matrix[row] = np.nan if v is None else v
+
+    def similarities(self, eids, prototypes):
+        """
+        Cosine similarity of every candidate event against each prototype, as one
+        matrix product. Returns an (n_events, n_prototypes) array with NaN where
+        either side has no usable vector.
+        """
+        out = np.full((len(eids), len(prototypes)), np.nan, dtype=np.float32)
+        P = np.full((self.width, len(prototypes)), np.nan, dtype=np.float32)
+        for j, proto in enumerate(prototypes):
+            v = normalize_words(proto, self.width)
+            if v is not None:
+                P[:, j] = v
+        rows = self.events.lookup(list(eids))
+        known = (rows >= 0) & (rows < len(self.matrix))
+        out[known] = self.matrix[rows[known]] @ P
+        return out
+
+def build_event_word_matrix(event_info, events=None):
+    # Width is taken from the first event with a non-empty word list.
+    events = events if events is not None else IdIndex()
+    words = field_values(event_info, 'words')
+    width = next((len(w) for w in words if w is not None and len(w)), 0)
+    for eid in event_info:
+        events.add(eid)
+    rows = events.lookup(list(event_info))
+    m = EventWordMatrix(events, np.full((len(events), width), np.nan, dtype=np.float32))
+    full = [i for i, w in enumerate(words) if w is not None and len(w) == width and width]
+    try:
+        W = np.log(np.array([words[i] for i in full], dtype=np.float64).reshape(-1, width) + 1)
+    except (TypeError, ValueError):
+        # Non-numeric word lists (e.g. tags from the SQL schema): fall back to row by row.
+        for eid, w in zip(event_info, words):
+            m.add(eid, w)
+        return m
+    norm = np.sqrt(np.sum(W * W, axis=1, keepdims=True))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        W = np.where(norm > 0, W / norm, np.nan)
+    m.matrix[rows[full]] = W
+    return m
@@ -6,8 +6,13 @@ import os
 import time
 
 # Import functions from your recommendation pipeline.
-from recommendation import process_events_for_user, get_full_data
+from recommendation import record_attendance
+from recommendation import generate_candidates, CANDIDATE_LIMITS, load_model_artifact, interaction_example
+from recommendation import rank_events, cascade_stats
+from datastore import DataStore
+from memo import cache_stats
 from model import Model
+from online import OnlineLR, ONLINE_LEARNING
 
 app = Flask(__name__)
 # Configure SQLAlchemy with a database URI. Here, we use SQLite for simplicity.
@@ -59,21 +64,21 @@ class Friend(db.Model):
 def create_tables():
     db.create_all()
     # Optionally, you could load initial data from CSVs into the database here.
-    # For instance, using get_full_data() from your pipeline, then iterating over the dictionaries.
+    # For instance, using DataStore.from_csv() from your pipeline, then iterating over the dictionaries.
     # For brevity, we assume the database is already populated.
 
 ######################################
 # Global Variables for Cache and Model
 ######################################
-DATA_CACHE = {}
 MODEL = None
+# Updates MODEL's LR from live interactions; None when the model is untrained or ONLINE_LEARNING=0.
+ONLINE = None
 
 def load_data_from_db():
     """
-    Loads all required data from the database and stores it in a global cache.
-    This data includes users, events, attendance, and friends.
+    Loads all required data from the database: users, events, attendance
+    indexed by user and by event, and friends.
     """
-    global DATA_CACHE
     # Load users into a dictionary.
     users = {user.id: {
                 "id": user.id,
@@ -121,33 +126,37 @@ def load_data_from_db():
     for rec in Friend.query.all():
         friends.setdefault(rec.user_id, []).append(rec.friend_id)
     
-    # Cache the data.
-    DATA_CACHE = {
-        "user_info": users,
-        "event_info": events,
-        "attendance_by_uid": attendance_by_uid,
-        "attendance_by_eid": attendance_by_eid,
-        "friends": friends
-    }
-    print("Data loaded from database and cached.")
+    print("Data loaded from database.")
+    return users, events, attendance_by_uid, attendance_by_eid, friends
+
+# In-memory data and recommender indexes, kept current by the write endpoints.
+STORE = DataStore(load_data_from_db)
 
 def load_model():
     """
-    Loads a pre-trained model from a pickle file.
+    Loads a pre-trained model, from its compiled artifact if there is one (which
+    fails if it was trained on another feature layout), else from a pickle file.
     """
-    global MODEL
+    global MODEL, ONLINE
+    model_artifact = "model.model"
     model_filename = "model.pkl"
-    if os.path.exists(model_filename):
+    if os.path.exists(model_artifact):
+        MODEL = load_model_artifact(model_artifact)
+        print("Pre-trained model artifact loaded.")
+    elif os.path.exists(model_filename):
         with open(model_filename, "rb") as f:
             MODEL = pickle.load(f)
         print("Pre-trained model loaded.")
     else:
         MODEL = Model()
         print("No pre-trained model found; new model instance created.")
+        return
+    if ONLINE_LEARNING:
+        ONLINE = OnlineLR(MODEL).start()
 
 # Initialize data and model at startup.
 with app.app_context():
-    load_data_from_db()
+    STORE.load()
 load_model()
 
 ######################################
@@ -184,15 +193,14 @@ def register():
     db.session.add(new_user)
     db.session.commit()
 
-    # Update in-memory cache.
-    DATA_CACHE["user_info"][new_user.id] = {
+    # Update in-memory data.
+    STORE.user_info[new_user.id] = {
         "id": new_user.id,
         "birth": new_user.birth,
         "gender": new_user.gender,
         "location": None if new_user.location is None else [float(x) for x in new_user.location.split(',')],
         "age": new_user.age
     }
-    DATA_CACHE["attendance_by_uid"][new_user.id] = []
 
     return jsonify({"message": "User registered successfully.", "user_id": new_user.id})
 
@@ -221,9 +229,9 @@ def update_interaction():
     interaction = data["interaction"]
 
     # Validate existence.
-    if user_id not in DATA_CACHE["user_info"]:
+    if user_id not in STORE.user_info:
         return jsonify({"error": f"User {user_id} not found."}), 404
-    if event_id not in DATA_CACHE["event_info"]:
+    if event_id not in STORE.event_info:
         return jsonify({"error": f"Event {event_id} not found."}), 404
 
     # Create a new attendance record.
@@ -239,7 +247,7 @@ def update_interaction():
     db.session.add(record)
     db.session.commit()
 
-    # Update in-memory cache.
+    # Update in-memory data.
     rec = {
         "uid": user_id,
         "eid": event_id,
@@ -249,17 +257,42 @@ def update_interaction():
         "no": record.no,
         "timestamp": record.timestamp
     }
-    DATA_CACHE["attendance_by_uid"].setdefault(user_id, []).append(rec)
-    DATA_CACHE["attendance_by_eid"].setdefault(event_id, []).append(rec)
+    # The training example uses the features from before this interaction.
+    example = interaction_example(STORE, rec) if ONLINE is not None else None
+    # Feeds the attendance indexes and drops the stale memoized similarities.
+    record_attendance(STORE, rec)
+    if example is not None:
+        ONLINE.add(*example)
 
     return jsonify({"message": "Interaction recorded."})
 
+@app.route("/cache_stats", methods=["GET"])
+def get_cache_stats():
+    """
+    Returns size, hit, miss, eviction and invalidation counters of the
+    recommender's memoized helpers (the per-user past events read by candidate
+    generation and the co-attendance feature).
+    """
+    return jsonify(cache_stats())
+
+@app.route("/cascade_stats", methods=["GET"])
+def get_cascade_stats():
+    """
+    Returns how often the cascade's top k differed from full scoring on the
+    audited requests, with the mean latency of both.
+    """
+    return jsonify(cascade_stats())
+
 @app.route("/recommend", methods=["GET"])
 def recommend():
     """
     Returns a list of recommended event IDs for a given user.
     Expects a query parameter 'user_id'.
-    The recommendations are generated by recomputing event features for the user.
+    Candidates come from a cheap retrieval stage (geo proximity, friends' events,
+    co-attendance neighbours, global popularity); only those are scored by
+    recomputing event features for the user, and ranked by the cascade (an LR
+    pre-score for all of them, the full model for the best few). Per-source candidate counts can be
+    overridden with query parameters named after the sources, e.g. '?geo=50&popularity=0'.
     """
     user_id_param = request.args.get("user_id")
     if not user_id_param:
@@ -270,41 +303,31 @@ def recommend():
     except ValueError:
         return jsonify({"error": "user_id must be an integer."}), 400
 
-    if user_id not in DATA_CACHE["user_info"]:
+    if user_id not in STORE.user_info:
         return jsonify({"error": f"User {user_id} not found."}), 404
 
-    # Build a dummy event dictionary.
-    # In a production system, you might filter events by location, date, etc.
-    e_dict = {}
-    for eid, event in DATA_CACHE["event_info"].items():
-        e_dict[eid] = (0, 0)  # Dummy invited flag and timestamp.
+    try:
+        limits = {name: int(request.args[name]) for name in CANDIDATE_LIMITS if name in request.args}
+    except ValueError:
+        return jsonify({"error": "Candidate limits must be integers."}), 400
+
+    # Retrieve candidates and score them with a dummy invited flag and timestamp.
+    event_ids, candidate_sources = generate_candidates(STORE, user_id, limits)
+    zeros = np.zeros(len(event_ids))
 
-    # Compute features for each event for the given user.
+    # Compute the candidates' features in batches and rank them.
     try:
-        features_dict = process_events_for_user(user_id, e_dict)
+        recommended_ids, _ = rank_events(STORE, MODEL, user_id, event_ids, invited=zeros, timestamps=zeros)
     except Exception as e:
         return jsonify({"error": f"Error processing events: {str(e)}"}), 500
 
-    X = []
-    event_ids = []
-    for eid, features in features_dict.items():
-        if features is None or not any(f is not None for f in features):
-            continue
-        event_ids.append(eid)
-        X.append(features)
-
-    if not X:
+    if not recommended_ids:
         return jsonify({"error": "No valid event features found for this user."}), 404
 
-    X = np.array(X)
-    predictions = MODEL.test(X)
-    # Pair each event ID with its prediction score.
-    recommended = sorted(list(zip(event_ids, predictions)), key=lambda x: -x[1])
-    recommended_ids = [eid for eid, score in recommended]
-
     return jsonify({
         "user_id": user_id,
-        "recommended_events": recommended_ids
+        "recommended_events": recommended_ids,
+        "candidate_sources": candidate_sources
     })
 
 if __name__ == "__main__":
@@ -13,6 +13,8 @@ from dateutil.parser import parse
 
 # Import your model and recommendation modules as needed
 from models.model import Model
+from models.attendance import RESPONSE_TYPES
+from models.event_counts import EventCounters
 # from models.recommendation import process_events_for_user
 from server.utils import Utils
 
@@ -146,6 +148,21 @@ def load_full_data_sql(db_session):
     
     return users, events, att_by_username, att_by_event, friends_dict
 
+# --------------------------------
+# Helper: Per-Event Response Counters
+# --------------------------------
+event_counters = None
+
+def get_event_counters(db_session):
+    # Built from the attendance table on first use, then bumped in place by /interaction.
+    global event_counters
+    if event_counters is None:
+        event_counters = EventCounters()
+        for att in db_session.query(Attendance).all():
+            if att.response in RESPONSE_TYPES:
+                event_counters.add(att.event, [att.response])
+    return event_counters
+
 # --------------------------------
 # Flask Application Setup with Flask-Session
 # --------------------------------
@@ -370,6 +387,7 @@ def interaction():
 
     db = SessionLocal()
     try:
+        counters = get_event_counters(db)
         new_attendance = Attendance(
             user=data["user"],
             event=data["event"],
@@ -379,6 +397,8 @@ def interaction():
         db.add(new_attendance)
         db.commit()
         db.refresh(new_attendance)
+        if data["response"] in RESPONSE_TYPES:
+            counters.add(data["event"], [data["response"]])
 
         # Update attendance info in the Flask session
         users, events, att_by_username, att_by_event, friends_dict = load_full_data_sql(db)
@@ -460,6 +480,14 @@ def recommendations_new():
         if friend_users:
             friend_attendance[event_id] = friend_users
 
+    # Response counts for every event, read in one go from the per-event counters.
+    db = SessionLocal()
+    try:
+        counters = get_event_counters(db)
+    finally:
+        db.close()
+    response_counts = dict(zip(event_info, counters.get(list(event_info), ['yes', 'maybe', 'no']).astype(int).tolist()))
+
     # Compose the prompt for the LLM.
     prompt = f"""
 You are an expert event recommendation agent for an events discovery platform. Your goal is to recommend the most relevant events to a user given the following information.
@@ -485,6 +513,7 @@ Event ID: {event_id}
   - Location: {event.get('location')}
   - Start Date: {event.get('start_date')}
   - Start Time: {event.get('start_time')}
+  - Responses: {response_counts[event_id][0]} yes, {response_counts[event_id][1]} maybe, {response_counts[event_id][2]} no
 """
         if event_id in friend_attendance:
             prompt += f"  - Friends Attending: {', '.join(friend_attendance[event_id])}\n"
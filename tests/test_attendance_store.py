@@ -0,0 +1,19 @@
+import numpy as np
+from models.attendance_store import AttendanceStore
+
+def test_compact_keeps_longer_string_ids():
+    store = AttendanceStore.from_columns(np.array(['ab', 'cd']), np.array([1, 2]), [1, 1])
+    store.add({'uid': 'longuserid', 'eid': 3, 'yes': True})
+    store.compact()
+    assert store.ids('user').tolist() == ['ab', 'cd', 'longuserid']
+    assert store.user_events('longuserid', ['yes']) == [3]
+
+def test_compact_mixes_string_and_int_ids():
+    store = AttendanceStore.from_columns(np.array([5, 7]), np.array([1, 2]), [1, 1])
+    store.add({'uid': 'bob', 'eid': 'x', 'maybe': True})
+    store.add({'uid': 6, 'eid': 2, 'yes': True})
+    store.compact()
+    assert [store.position('user', uid) for uid in [5, 6, 7, 'bob', '5']] == [0, 1, 2, 3, -1]
+    assert store.by_user()['bob'] == [{'uid': 'bob', 'eid': 'x', 'maybe': True}]
+    assert store.by_event()[2] == [{'uid': 7, 'eid': 2, 'yes': True}, {'uid': 6, 'eid': 2, 'yes': True}]
+    assert store.user(6).flags.dtype == np.uint8
@@ -0,0 +1,193 @@
+import random
+from math import sqrt
+import numpy as np
+import pytest
+import models.recommendation as r
+from models.coattendance import build_coattendance_index
+
+ATTR = ['yes', 'no', 'maybe', 'invited']
+
+def make_data(seed=0, n_users=30, n_events=40, n_records=400, width=10):
+    rng = random.Random(seed)
+    places = [{'country': 'indonesia', 'state': 'jawa', 'city': 'jogjakarta'},
+              {'country': 'indonesia', 'city': 'yogyakarta'},
+              {'country': 'france', 'state': 'idf', 'city': 'paris'},
+              {'country': 'france'}]
+    point = lambda: [rng.uniform(-5, 5), rng.uniform(100, 110)]
+    taste = lambda: {key: [rng.random() for _ in range(3)] for key in ['cl0', 'cl1', 'cl2']}
+    words = lambda: [rng.randint(0, 3) for _ in range(width)]
+    uids = list(range(1000, 1000 + n_users))
+    event_info = {}
+    for eid in range(n_events):
+        e = {'id': eid, 'cl0': rng.randrange(3), 'cl1': rng.randrange(3), 'cl2': rng.randrange(3),
+             'words': words() if eid % 7 else [0] * width, 'creator': rng.choice(uids),
+             'newloc2': rng.sample(places, rng.randint(0, 2))}
+        if eid % 5:
+            e['start'] = 1.35e9 + rng.randint(0, 10**6)
+        if eid % 6 == 1:
+            e['location'] = [point(), point()]
+        elif eid % 4:
+            e['location'] = point()
+        if eid % 3:
+            e['ages'] = {'mean': rng.uniform(18, 40)}
+        if eid % 4 != 2:
+            e['genders'] = {'male': rng.randint(0, 5), 'female': rng.randint(0, 5)}
+        event_info[eid] = e
+    user_info = {}
+    for uid in uids:
+        u = {'id': uid, 'newloc2': rng.sample(places, rng.randint(0, 2))}
+        if uid % 4:
+            u['birth'] = str(rng.randint(1970, 1995))
+        if uid % 5:
+            u['gender'] = rng.choice(['male', 'female'])
+        if uid % 3:
+            u['location'] = point()
+        for key in ['user_taste', 'friends_taste', 'user_hates', 'friends_hate', 'user_invited']:
+            if rng.random() < 0.7:
+                u[key] = taste()
+        for key in ['prototype', 'prototype_invite', 'prototype_hate']:
+            if rng.random() < 0.7:
+                u[key] = words()
+        user_info[uid] = u
+    attendance_by_uid, attendance_by_eid = {}, {}
+    for _ in range(n_records):
+        record = {'uid': rng.choice(uids), 'eid': rng.randrange(n_events)}
+        for kind in rng.sample(ATTR, rng.randint(1, 2)):
+            record[kind] = True
+        attendance_by_uid.setdefault(record['uid'], []).append(record)
+        attendance_by_eid.setdefault(record['eid'], []).append(record)
+    friends = {uid: rng.sample(uids, rng.randint(0, 8)) for uid in uids}
+    return user_info, event_info, attendance_by_uid, attendance_by_eid, friends
+
+# --- Reference: the original per-event feature loop over attendance dicts ---
+def event_sim_by_users(attendance_by_eid, id1, id2, exclude):
+    set1 = {a['uid'] for a in attendance_by_eid.get(id1, []) if a.get('yes') or a.get('maybe')}
+    set2 = {a['uid'] for a in attendance_by_eid.get(id2, []) if a.get('yes') or a.get('maybe')}
+    s = float(len(set1 & set2))
+    if exclude in set1 & set2:
+        s -= 1
+    return s / min(len(set1), len(set2)) if min(len(set1), len(set2)) > 0 else 0
+
+def event_similarity_by_user(attendance_by_uid, attendance_by_eid, uid, eid):
+    sims = [event_sim_by_users(attendance_by_eid, eid, e2['eid'], uid) for e2 in attendance_by_uid.get(uid, [])
+            if (e2.get('yes') or e2.get('maybe')) and e2['eid'] != eid]
+    return sum(sims) / len(sims) if sims else None
+
+def location_distance(l1, l2):
+    if not l1 or not l2:
+        return None
+    l1 = [l1] if isinstance(l1[0], float) else l1
+    l2 = [l2] if isinstance(l2[0], float) else l2
+    return min(sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) for a in l1 for b in l2)
+
+def event_distance(w1, w2):
+    if not w1 or not w2:
+        return None
+    w1, w2 = np.log(np.array(w1) + 1), np.log(np.array(w2) + 1)
+    denom = np.sqrt(np.sum(w1 * w1)) * np.sqrt(np.sum(w2 * w2))
+    return None if denom == 0 else np.sum(w1 * w2) / denom
+
+def difference(v1, v2):
+    return v1 - v2 if v1 is not None and v2 is not None else None
+
+def reference_features(data, uid, e_dict):
+    user_info, event_info, attendance_by_uid, attendance_by_eid, friends = data
+    user = user_info[uid]
+    friend_ids = set(friends.get(uid, []))
+    rows = {}
+    for eid in e_dict:
+        e = event_info[eid]
+        attend = attendance_by_eid.get(eid, [])
+        counts = [sum(1 for a in attend if a.get(kind)) for kind in ATTR]
+        f = counts + [c * 1.0 / (counts[0] + 1) for c in counts[1:]]
+        fc = [sum(1 for a in attend if a['uid'] in friend_ids and a.get(kind)) for kind in ATTR]
+        f += fc + [c * 1.0 / (fc[0] + 1) for c in fc[1:]] + [c / (len(friend_ids) + 1.0) for c in fc]
+        f += r.process_locations(e.get('newloc2', []), user.get('newloc2', []))
+        if user.get('birth') and 'ages' in e:
+            f.append(abs(2013 - int(user['birth']) - e['ages']['mean']) + int(random.random() * 6))
+        else:
+            f.append(None)
+        if user.get('gender') and 'genders' in e:
+            g = e['genders']
+            f.append((g[user['gender']] + 1.0) / (g.get('male', 0) + g.get('female', 0) + 2.0))
+        else:
+            f.append(None)
+        f.append(event_similarity_by_user(attendance_by_uid, attendance_by_eid, uid, eid))
+        for key in ['user_taste', 'friends_taste', 'user_hates', 'friends_hate', 'user_invited']:
+            t = user.get(key)
+            f.append(t['cl0'][e['cl0']] * 8 + t['cl1'][e['cl1']] * 20 + t['cl2'][e['cl2']] * 40 if t else None)
+        f.append(e['start'] - e_dict[eid][1] if 'start' in e else None)
+        f.append(e.get('creator') in friend_ids)
+        sim = {key: event_distance(user[key], e['words']) if key in user else None
+               for key in ['prototype', 'prototype_invite', 'prototype_hate']}
+        f += [sim['prototype'], difference(sim['prototype'], sim['prototype_invite']),
+              difference(sim['prototype_hate'], sim['prototype_invite']),
+              difference(sim['prototype_hate'], sim['prototype'])]
+        f.append(e_dict[eid][0])
+        f.append(location_distance(e.get('location'), user.get('location')))
+        rows[eid] = np.array([np.nan if v is None else float(v) for v in f])
+    return rows
+
+@pytest.fixture(scope='module')
+def data():
+    return make_data()
+
+@pytest.fixture(scope='module')
+def store(data):
+    return r.DataStore.from_dicts(*data)
+
+def batch_and_reference(data, store, uid):
+    rng = random.Random(uid)
+    eids = rng.sample(list(data[1]), 25)
+    e_dict = {eid: (rng.randint(0, 1), 1.35e9 + rng.randint(0, 10**6)) for eid in eids}
+    # Column 19 adds random jitter, drawn in event order by both paths.
+    random.seed(uid)
+    batch = r.process_events_for_user(store, uid, e_dict)
+    random.seed(uid)
+    return batch, reference_features(data, uid, e_dict)
+
+def test_batch_engine_matches_per_event_loop(data, store):
+    # Exact up to the float32 output. Column 21 comes from the co-attendance
+    # index, which keeps each event's top K (50) neighbours; the fixture has
+    # fewer events than K, so nothing is truncated and it matches too.
+    for uid in data[0]:
+        batch, reference = batch_and_reference(data, store, uid)
+        assert list(batch) == list(reference)
+        X = np.array([batch[eid] for eid in batch])
+        R = np.array([reference[eid] for eid in reference]).astype(np.float32)
+        assert X.shape[1] == len(r.FEATURE_NAMES)
+        for col, name in enumerate(r.FEATURE_NAMES):
+            np.testing.assert_allclose(X[:, col], R[:, col], rtol=1e-5, atol=1e-6, equal_nan=True,
+                                       err_msg=f"user {uid}, column {col} ({name})")
+
+def test_coattendance_truncation_only_lowers_similarity(data):
+    # With a truncated index, past events outside a candidate's top K count as
+    # zero overlap: column 21 may fall below the exact mean, never above it,
+    # and every other column is unaffected.
+    store = r.DataStore.from_dicts(*data)
+    store._indexes['coattendance_index'] = build_coattendance_index(store.attendance_matrices, k=3)
+    col = r.FEATURE_NAMES.index('coattendance_similarity')
+    lower = 0
+    for uid in data[0]:
+        batch, reference = batch_and_reference(data, store, uid)
+        X = np.array([batch[eid] for eid in batch])
+        R = np.array([reference[eid] for eid in reference]).astype(np.float32)
+        known = ~np.isnan(R[:, col])
+        assert np.isnan(X[~known, col]).all()
+        assert (X[known, col] <= R[known, col] + 1e-6).all()
+        lower += (X[known, col] < R[known, col] - 1e-6).sum()
+        others = [c for c in range(X.shape[1]) if c != col]
+        np.testing.assert_allclose(X[:, others], R[:, others], rtol=1e-5, atol=1e-6, equal_nan=True)
+    assert lower > 0
+
+def test_parallel_feature_build_matches_serial(data, store):
+    # user_features seeds the age jitter per user, so workers reproduce the serial rows exactly.
+    rng = random.Random(1)
+    tasks = [(uid, {eid: (rng.randint(0, 1), 1.35e9) for eid in rng.sample(list(data[1]), 10)})
+             for uid in data[0]]
+    serial = r.build_user_features(store, tasks, 1)
+    parallel = r.build_user_features(store, tasks, 2)
+    for a, b in zip(serial, parallel):
+        assert list(a) == list(b)
+        for eid in a:
+            np.testing.assert_array_equal(a[eid], b[eid])
@@ -0,0 +1,71 @@
+import os
+import numpy as np
+import pytest
+import models.datastore as datastore
+import models.recommendation as r
+from models.attendance import build_attendance_matrices
+from models.ids import IdIndex
+from models.coattendance import CoAttendanceIndex, build_coattendance_index, delta_path
+
+def attendance(records):
+    by_uid = {}
+    for uid, eid in records:
+        by_uid.setdefault(uid, []).append({'uid': uid, 'eid': eid, 'yes': True})
+    return by_uid
+
+@pytest.fixture
+def upstream(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(datastore, 'cache_digests', {'cache_event_info_sampled': 'e1', 'cache_attendance': 'a1'})
+    return datastore.cache_digests
+
+def test_live_updates_are_replayed_from_the_delta(upstream):
+    matrices = build_attendance_matrices(attendance([(1, 10), (1, 11), (2, 10), (2, 12)]))
+    index = datastore.get_coattendance_index(matrices, 'coattendance')
+    index.add(11, [10, 12])
+    index.save_delta('coattendance')
+    expected = [index.neighbors.copy(), index.overlaps.copy(), index.sizes.copy()]
+    assert np.load('coattendance/sizes.npy').tolist() == [2, 1, 1]
+
+    # The saved index is the one its manifest describes; the live update comes back from the delta.
+    loaded = datastore.get_coattendance_index(matrices, 'coattendance')
+    for a, b in zip(expected, [loaded.neighbors, loaded.overlaps, loaded.sizes]):
+        np.testing.assert_array_equal(a[:3], b[:3])
+
+    # New attendance rebuilds the index, and the delta made on the old one is dropped.
+    upstream['cache_attendance'] = 'a2'
+    rebuilt = datastore.get_coattendance_index(matrices, 'coattendance')
+    assert rebuilt.sizes[:3].tolist() == [2, 1, 1]
+    assert not os.path.exists(delta_path('coattendance'))
+
+def test_live_updates_keep_the_top_k():
+    # Once an event's k slots are full, a pair that overtakes the weakest neighbour replaces it,
+    # so the live index keeps the overlaps a fresh build finds.
+    rng = np.random.default_rng(0)
+    records = [(int(u), int(e)) for u, e in zip(rng.integers(0, 30, 150), rng.integers(0, 40, 150))]
+    by_uid = attendance(records)
+    by_eid = {}
+    for records_of_user in by_uid.values():
+        for record in records_of_user:
+            by_eid.setdefault(record['eid'], []).append(record)
+    store = r.DataStore.from_dicts({uid: {'id': uid} for uid in range(30)}, {eid: {'id': eid} for eid in range(40)},
+                                   by_uid, by_eid, {})
+    store._indexes['coattendance_index'] = build_coattendance_index(store.attendance_matrices, k=3)
+    for uid, eid in zip(rng.integers(0, 30, 600).tolist(), rng.integers(0, 40, 600).tolist()):
+        r.record_attendance(store, {'uid': uid, 'eid': eid, 'yes': True})
+    live, fresh = store.coattendance_index, build_coattendance_index(store.attendance_matrices, k=3)
+    for eid in range(40):
+        a, b = live.events.get(eid), fresh.events.get(eid)
+        assert sorted(live.overlaps[a][live.neighbors[a] >= 0]) == sorted(fresh.overlaps[b][fresh.neighbors[b] >= 0])
+    assert live.sizes[:40].tolist() == fresh.sizes[:40].tolist()
+
+def test_saved_ids_keep_their_types(tmp_path):
+    # Int and string event ids come back as they were and remap onto another event index.
+    matrices = build_attendance_matrices(attendance([(1, 10), (1, 'e11'), (2, 10), (2, 'e11'), (3, 'e11'), (3, 12)]))
+    build_coattendance_index(matrices).save(str(tmp_path / 'coattendance'))
+    events = IdIndex(['e11', 7, 12, 10])
+    index = CoAttendanceIndex.load(str(tmp_path / 'coattendance'), events)
+    assert events.ids == ['e11', 7, 12, 10]
+    assert index.sizes[:4].tolist() == [3, 0, 1, 2]
+    assert index.neighbors_of([10]) == ['e11']
+    assert index.neighbors_of(['e11']) == [10, 12]
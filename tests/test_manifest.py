@@ -0,0 +1,99 @@
+import os
+import json
+import pytest
+import models.datastore as datastore
+from models.attendance import build_attendance_matrices
+from models.manifest import CACHE_SCHEMA_VERSION
+
+ALL = {'cache_users', 'cache_event_info_sampled', 'cache_friends', 'cache_attendance', 'cache_user_info',
+       'cache_ids', 'cache_coattendance'}
+
+def write(path, rows):
+    with open(path, 'w') as f:
+        f.write('\n'.join(' '.join(map(str, row)) for row in rows) + '\n')
+
+def stage(source, parse):
+    # A load stage whose artifact is the source's parsed rows as JSON.
+    def build(path):
+        with open(source) as f, open(path, 'w') as out:
+            json.dump([[int(v) for v in line.split()] for line in f if line.strip()], out)
+    def load(path):
+        with open(path) as f:
+            return parse(json.load(f))
+    return build, load
+
+def attendance(rows):
+    by_uid, by_eid = {}, {}
+    for uid, eid in rows:
+        record = {'uid': uid, 'eid': eid, 'yes': True}
+        by_uid.setdefault(uid, []).append(record)
+        by_eid.setdefault(eid, []).append(record)
+    return by_uid, by_eid
+
+def save_users(path, users):
+    with open(path, 'w') as f:
+        json.dump(list(users), f)
+
+def load_users(path):
+    with open(path) as f:
+        return {uid: {'id': uid} for uid in json.load(f)}
+
+@pytest.fixture
+def load_all(tmp_path, monkeypatch, capsys):
+    """
+    The CSV cache chain of DataStore.from_csv on tiny sources, with the real
+    upstream declarations of every derived artifact. Returns a function that
+    loads everything and returns the set of artifacts it rebuilt.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(datastore, 'cache_digests', {})
+    monkeypatch.setattr(datastore, 'fill_missing_location', lambda *args, **kwargs: None)
+    monkeypatch.setattr(datastore, 'process_and_update_ages', lambda users: None)
+    monkeypatch.setattr(datastore, 'save_user_info', save_users)
+    monkeypatch.setattr(datastore, 'load_user_info', load_users)
+    stages = {}
+    for name, path, source, parse in [
+            ('users', 'cache_users', 'users.csv', lambda rows: {uid: {'id': uid} for uid, in rows}),
+            ('events', 'cache_event_info_sampled', 'events.csv', lambda rows: {eid: {'id': eid} for eid, in rows}),
+            ('friends', 'cache_friends', 'friends.csv', lambda rows: {uid: friends for uid, *friends in rows}),
+            ('attendance', 'cache_attendance', 'attendance.csv', attendance)]:
+        build, load = stage(source, parse)
+        stages[name] = (path, load, build, [source])
+    monkeypatch.setattr(datastore, 'LOAD_STAGES', stages)
+    write('users.csv', [[1], [2], [3]])
+    write('events.csv', [[10], [11], [12]])
+    write('friends.csv', [[1, 2], [2, 3]])
+    write('attendance.csv', [[1, 10], [1, 11], [2, 10], [3, 12]])
+
+    def run():
+        capsys.readouterr()
+        data = datastore.load_stages(workers=1)
+        by_uid, by_eid = data['attendance']
+        user_info = datastore.get_user_info(data['users'], data['events'], by_uid, by_eid)
+        ids = datastore.get_ids(user_info, data['events'], by_uid, data['friends'])
+        datastore.get_coattendance_index(build_attendance_matrices(by_uid, ids=ids))
+        out = capsys.readouterr().out
+        return {line.split()[-1] for line in out.splitlines() if line.startswith('[CACHE] Rebuilding')}
+    return run
+
+def test_unchanged_sources_rebuild_nothing(load_all):
+    assert load_all() == ALL
+    assert load_all() == set()
+    # A touched file with the same content is not a change.
+    os.utime('events.csv', ns=(0, 0))
+    assert load_all() == set()
+
+def test_source_change_rebuilds_only_its_dependents(load_all):
+    load_all()
+    write('friends.csv', [[1, 2], [2, 3], [3, 4]])
+    assert load_all() == {'cache_friends', 'cache_ids'}
+    write('events.csv', [[10], [11], [12], [13]])
+    assert load_all() == {'cache_event_info_sampled', 'cache_user_info', 'cache_ids', 'cache_coattendance'}
+    write('attendance.csv', [[1, 10], [2, 10]])
+    assert load_all() == {'cache_attendance', 'cache_user_info', 'cache_ids', 'cache_coattendance'}
+    assert load_all() == set()
+
+def test_schema_version_bump_rebuilds_everything(load_all, monkeypatch):
+    load_all()
+    monkeypatch.setattr('models.manifest.CACHE_SCHEMA_VERSION', CACHE_SCHEMA_VERSION + 1)
+    assert load_all() == ALL
@@ -0,0 +1,24 @@
+from models.memo import LRUMemo
+
+def test_value_invalidated_while_computing_is_not_stored():
+    values = {'u': 1}
+    def compute(uid):
+        value = values[uid]
+        # A write lands after the value was read, before it is stored.
+        values[uid] += 1
+        memo.invalidate_user(uid)
+        return value
+    memo = LRUMemo(compute, maxsize=10, user_arg=0)
+    assert memo('u') == 1
+    assert len(memo.memo) == 0
+    memo.function = lambda uid: values[uid]
+    assert memo('u') == 2
+    assert memo('u') == 2
+    assert memo.stats()['hits'] == 1
+
+def test_invalidate_user_drops_only_that_user():
+    memo = LRUMemo(lambda store, uid: uid * 2, maxsize=10, user_arg=1)
+    memo(None, 1), memo(None, 2)
+    memo.invalidate_user(1)
+    assert list(memo.memo) == [(None, 2)]
+    assert memo.stats()['invalidations'] == 1
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from models.model import Model, MODEL_ARTIFACT_VERSION
+
+def make_data(n=600, width=8, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, width))
+    y = (X[:, 0] + 0.5 * X[:, 1] - X[:, 2] + rng.normal(scale=0.5, size=n) > 0).astype(int)
+    # Missing values in every column, including the LR ones (imputed) and the forest-only ones (routed).
+    X[rng.random(X.shape) < 0.1] = np.nan
+    return X, y
+
+@pytest.fixture(scope='module')
+def model():
+    X, y = make_data()
+    compress = [True] * 8
+    compress[5] = False
+    has_none = [True, True, True, False, True, False, True, False]
+    m = Model(compress=compress, has_none=has_none, C=1.0, n_est=25)
+    m.fit(X, y)
+    return m
+
+def test_compiled_model_matches_sklearn(model):
+    X, _ = make_data(n=400, seed=1)
+    X[0] = np.nan
+    assert np.allclose(model.test(X), model.test_sklearn(X))
+
+NAMES = [f'f{i}' for i in range(8)]
+
+@pytest.fixture
+def artifact(model, tmp_path):
+    dirname = str(tmp_path / 'model')
+    model.save(dirname, NAMES, 3)
+    return dirname
+
+def test_saved_model_scores_like_the_original(model, artifact):
+    X, _ = make_data(n=400, seed=2)
+    loaded = Model.load(artifact, NAMES, 3)
+    assert loaded.models is None
+    np.testing.assert_array_equal(loaded.test(X), model.test(X))
+    assert loaded.lr_features() == model.lr_features()
+
+@pytest.mark.parametrize('names, schema', [(NAMES[:-1], 3), (NAMES[::-1], 3), (NAMES, 4)])
+def test_load_rejects_other_features(artifact, names, schema):
+    with pytest.raises(ValueError):
+        Model.load(artifact, names, schema)
+
+def test_load_rejects_other_artifact_versions(artifact, monkeypatch):
+    monkeypatch.setattr('models.model.MODEL_ARTIFACT_VERSION', MODEL_ARTIFACT_VERSION + 1)
+    with pytest.raises(ValueError):
+        Model.load(artifact, NAMES, 3)
@@ -0,0 +1,81 @@
+import threading
+import numpy as np
+import pytest
+import models.recommendation as r
+from models.model import Model
+from models.online import OnlineLR
+from models.forest import expit
+
+def make_data(n=400, width=6, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, width))
+    y = (X[:, 0] - X[:, 1] + rng.normal(scale=0.5, size=n) > 0).astype(int)
+    X[rng.random(X.shape) < 0.1] = np.nan
+    return X, y
+
+@pytest.fixture
+def model():
+    X, y = make_data()
+    m = Model(compress=[True] * 6, has_none=[True, True, True, False, True, True], C=1.0, n_est=5)
+    m.fit(X, y)
+    m.compile()
+    return m
+
+def test_step_moves_coefficients_against_the_gradient(model):
+    online = OnlineLR(model, batch=64, learning_rate=0.01, l1=0)
+    X, y = make_data(n=64, seed=1)
+    # Labels flipped from what the model learned, so every batch has a clear gradient.
+    y = 1 - y
+    w = np.append(online.coef, online.intercept)
+    X_lr = np.column_stack([model.inputs(X)[1], np.ones(len(X))])
+    grad = X_lr.T @ (expit(X_lr @ w) - y) / len(y)
+    for x, label in zip(X, y):
+        online.add(x, label)
+    online.flush()
+    step = np.append(online.coef, online.intercept) - w
+    assert online.updates == 1 and online.examples == 64
+    moved = grad != 0
+    assert (np.sign(step[moved]) == -np.sign(grad[moved])).all()
+    # The first AdaGrad step is learning_rate per coordinate.
+    np.testing.assert_allclose(np.abs(step[moved]), 0.01, rtol=1e-4)
+    np.testing.assert_array_equal(model.compiled[1].coef, online.coef)
+
+def test_l1_truncates_small_coefficients(model):
+    online = OnlineLR(model, learning_rate=0.01, l1=1e6)
+    X, y = make_data(n=32, seed=2)
+    online.step(X, y)
+    assert not online.coef.any()
+
+def test_scores_use_one_published_pair(model):
+    # Model.test never mixes the forest or coefficients of two steps.
+    online = OnlineLR(model, batch=8, learning_rate=0.5, l1=0)
+    X, y = make_data(n=64, seed=3)
+    published = [model.compiled]
+    publish = online.publish
+    def record():
+        publish()
+        published.append(model.compiled)
+    online.publish = record
+    scores, stop = [], threading.Event()
+    def score():
+        while not stop.is_set():
+            scores.append(model.test(X[:4]))
+    reader = threading.Thread(target=score)
+    reader.start()
+    for _ in range(50):
+        online.step(X, 1 - y)
+    stop.set()
+    reader.join()
+    forest_weight, lr_weight = model.weights
+    X_rf, X_lr = model.inputs(X[:4])
+    expected = [forest.predict(X_rf) * forest_weight + lr.predict(X_lr) * lr_weight for forest, lr in published]
+    assert all(any(np.array_equal(s, e) for e in expected) for s in scores)
+
+def test_interaction_with_unknown_event_gives_no_example():
+    store = r.DataStore.from_dicts({1: {'id': 1}}, {10: {'id': 10, 'cl0': 0, 'cl1': 0, 'cl2': 0, 'words': []}},
+                                   {}, {}, {})
+    assert r.interaction_example(store, {'uid': 1, 'eid': 99, 'yes': True}) is None
+    assert r.interaction_example(store, {'uid': 1, 'eid': 10, 'maybe': True}) is None
+    assert r.interaction_example(store, None) is None
+    x, label = r.interaction_example(store, {'uid': 1, 'eid': 10, 'no': True})
+    assert label == 0 and len(x) == len(r.FEATURE_NAMES)